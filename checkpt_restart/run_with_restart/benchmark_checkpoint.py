@@ -0,0 +1,363 @@
+"""
+Benchmark of the cost of checkpointing and restarting, using the test cases
+in this directory.
+
+For each case, problem size (num_cells multiplied by each of the scales)
+and checkpoint interval (checkpt_style 3, every N level 1 steps, where 0
+means no checkpoints at all) the code is run to tfinal and the following
+are measured:
+
+ - the wall time of the run, and the overhead relative to the run of the
+   same size without checkpoints,
+ - the size of each checkpoint and the time taken to write it (timed by
+   polling, see CheckpointTimer in checkpoint_interval.py),
+ - the time taken to read a checkpoint on restart: the wall time of a
+   restart from the middle checkpoint that takes no time steps, minus the
+   wall time of a run from scratch that takes no time steps,
+ - whether the final frame (fort.q at the largest time) is bit-for-bit
+   identical to the one from the run without checkpoints, both for the
+   checkpointed run and for a restart from its middle checkpoint run on to
+   tfinal (with the frames and later checkpoints of the first run removed
+   beforehand).  A restart that fails counts as not identical.
+
+Every run is made in its own copy of the case directory under the work
+directory, with the executable built once per case (see exe_cache.py) and
+run directly in _output.  The results are written as JSON so that they can
+be compared between Clawpack versions.
+
+Usage:
+
+    python benchmark_checkpoint.py [--cases test_advection_2d_square ...]
+        [--intervals 0 20 10 5] [--scales 1 2] [--threads 3] [--repeat 1]
+        [--workdir _benchmark] [--json benchmark_checkpoint.json]
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import glob
+import time
+import shutil
+import socket
+import subprocess
+
+import checkpoint_manifest
+import exe_cache
+from checkpoint_interval import CheckpointTimer
+from run_with_restart import runtime_env, load_setrun, outdir
+
+cases_default = ['test_advection_2d_square', 'test_burgers_3d_cubedata']
+
+
+def copy_case(case_dir, rundir):
+    """
+    Copy the case in case_dir to a fresh rundir, without any output.
+    """
+
+    if os.path.isdir(rundir):
+        shutil.rmtree(rundir)
+    shutil.copytree(case_dir, rundir,
+                    ignore=shutil.ignore_patterns('_output*', '_plots*',
+                                                  '*.o', '*.mod', '.exe_cache',
+                                                  'run_*.txt'))
+
+
+def write_data(rundir, scale=1, interval=0, restart_file=None,
+               num_steps=None):
+    """
+    Write the data files for a run in rundir with num_cells multiplied by
+    scale and a checkpoint every interval level 1 steps (none if 0).  If
+    restart_file is given the run restarts from it, and if num_steps is given
+    the run stops after that many level 1 steps with no output.
+    Returns the rundata.
+    """
+
+    setrun = load_setrun(rundir)
+    rundata = setrun('amrclaw')
+    clawdata = rundata.clawdata
+
+    clawdata.num_cells = [n*scale for n in clawdata.num_cells]
+    if interval > 0:
+        clawdata.checkpt_style = 3
+        clawdata.checkpt_interval = interval
+    else:
+        clawdata.checkpt_style = 0
+
+    clawdata.restart = restart_file is not None
+    if restart_file is not None:
+        clawdata.restart_file = restart_file
+        clawdata.output_t0 = False
+
+    if num_steps is not None:
+        clawdata.output_style = 3
+        clawdata.output_step_interval = 1
+        clawdata.total_steps = num_steps
+        clawdata.output_t0 = False
+
+    rundata.write(out_dir=rundir)
+    exe_cache.prepare_outdir(rundir, os.path.join(rundir, outdir))
+    return rundata
+
+
+def run_exe(exe, rundir, env, poll_interval=0.02):
+    """
+    Run exe in rundir/_output, timing the checkpoints written.  Returns
+    (wall time, return code, list of checkpoint writes).
+    """
+
+    rundir_outdir = os.path.join(rundir, outdir)
+    timer = CheckpointTimer(rundir_outdir)
+    with open(os.path.join(rundir, 'run_output.txt'), 'a') as fout, \
+            open(os.path.join(rundir, 'run_errors.txt'), 'a') as ferr:
+        t_start = time.time()
+        job = subprocess.Popen([exe], cwd=rundir_outdir, env=env,
+                               stdout=fout, stderr=ferr)
+        while job.poll() is None:
+            time.sleep(poll_interval)
+            timer.check()
+        wall = time.time() - t_start
+    timer.check()
+    return wall, job.returncode, timer.writes
+
+
+def final_frame_hash(outdir):
+    """
+    Checksum of the fort.q file of the frame with the largest time in outdir
+    (the most recently written one if several have that time).
+    """
+
+    frames = []
+    for tfile in glob.glob(os.path.join(outdir, 'fort.t[0-9]*')):
+        try:
+            with open(tfile) as f:
+                t = float(f.readline().split()[0])
+        except (IOError, OSError, ValueError, IndexError):
+            continue
+        frames.append((t, os.path.getmtime(tfile), tfile))
+    if len(frames) == 0:
+        return None
+    t, mtime, tfile = max(frames)
+    qfile = os.path.join(outdir, 'fort.q' + os.path.basename(tfile)[6:])
+    if not os.path.isfile(qfile):
+        return None
+    return checkpoint_manifest.file_checksum(qfile)
+
+
+def clear_after(outdir, t_restart):
+    """
+    Remove the output frames, and the checkpoints later than t_restart,
+    from outdir, so that those there after a restart from the checkpoint at
+    t_restart were written by the restarted run.
+    """
+
+    for pattern in ['fort.q[0-9]*', 'fort.t[0-9]*', 'fort.a[0-9]*',
+                    'fort.b[0-9]*']:
+        for fname in glob.glob(os.path.join(outdir, pattern)):
+            os.remove(fname)
+    for tckfile in glob.glob(os.path.join(outdir, 'fort.tck*')):
+        try:
+            t, step = checkpoint_manifest.read_tck(tckfile)
+        except (IOError, OSError, ValueError, IndexError):
+            continue
+        if t > t_restart:
+            chkfile = tckfile.replace('fort.tck', 'fort.chk')
+            for fname in [tckfile, chkfile]:
+                if os.path.exists(fname):
+                    os.remove(fname)
+
+
+def benchmark_run(exe, case_dir, rundir, env, scale, interval, repeat=1):
+    """
+    Run the case in a copy at rundir repeat times with the given scale and
+    checkpoint interval, and if checkpoints were written also time a restart
+    from the middle one.  Returns a dictionary of results.
+    """
+
+    result = {'case': os.path.basename(os.path.normpath(case_dir)),
+              'scale': scale,
+              'checkpt_interval': interval if interval > 0 else None}
+
+    walls = []
+    for n in range(repeat):
+        copy_case(case_dir, rundir)
+        rundata = write_data(rundir, scale, interval)
+        wall, return_code, writes = run_exe(exe, rundir, env)
+        walls.append(wall)
+        if return_code != 0:
+            break
+
+    rundir_outdir = os.path.join(rundir, outdir)
+    result['num_cells'] = list(rundata.clawdata.num_cells)
+    result['return_code'] = return_code
+    result['wall'] = min(walls)
+    result['walls'] = walls
+    result['final_hash'] = final_frame_hash(rundir_outdir)
+
+    manifest = checkpoint_manifest.update_manifest(rundir_outdir)
+    checkpoints = sorted((entry['time'], suffix) for suffix, entry
+                         in manifest['checkpoints'].items()
+                         if entry['complete'])
+    timed = [w['seconds'] for w in writes if w['seconds'] is not None]
+    result['num_checkpoints'] = len(checkpoints)
+    result['checkpoint_bytes'] = sum(manifest['checkpoints'][s]['size']
+                                     for t, s in checkpoints)
+    result['checkpoint_write_seconds'] = sum(timed) if timed else None
+    result['checkpoint_writes'] = writes
+
+    if return_code != 0 or len(checkpoints) == 0:
+        return result
+
+    # restart from the middle checkpoint, first taking no steps to time
+    # reading it and then on to tfinal to check the final frame:
+    t_restart, suffix = checkpoints[len(checkpoints) // 2]
+    restart_file = 'fort.chk' + suffix
+    result['restart_file'] = restart_file
+    result['restart_time'] = t_restart
+
+    clear_after(rundir_outdir, t_restart)
+    write_data(rundir, scale, interval, restart_file, num_steps=0)
+    result['restart_wall'], restart_code, w = run_exe(exe, rundir, env)
+    result['restart_read_return_code'] = restart_code
+
+    clear_after(rundir_outdir, t_restart)
+    write_data(rundir, scale, interval, restart_file)
+    wall, return_code, w = run_exe(exe, rundir, env)
+    result['restart_run_wall'] = wall
+    result['restart_return_code'] = return_code
+    result['restart_final_hash'] = final_frame_hash(rundir_outdir)
+    return result
+
+
+def startup_wall(exe, case_dir, rundir, env, scale):
+    """
+    Wall time of a run from scratch that takes no time steps.
+    """
+
+    copy_case(case_dir, rundir)
+    write_data(rundir, scale, 0, num_steps=0)
+    wall, return_code, writes = run_exe(exe, rundir, env)
+    return wall
+
+
+def clawpack_version():
+    try:
+        import clawpack
+        return clawpack.__version__
+    except (ImportError, AttributeError):
+        return None
+
+
+def benchmark(case_dirs=cases_default, intervals=[0, 20, 10, 5],
+              scales=[1, 2], num_threads=3, repeat=1, workdir='_benchmark'):
+    """
+    Run the benchmark for all combinations of case, scale and interval and
+    return the results.
+    """
+
+    env = runtime_env(num_threads)
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+    cache_dir = os.path.join(workdir, '.exe_cache')
+    if 0 not in intervals:
+        intervals = [0] + list(intervals)   # needed as the reference
+
+    results = []
+    for case_dir in case_dirs:
+        case = os.path.basename(os.path.normpath(case_dir))
+        build_dir = os.path.join(workdir, case + '_build')
+        copy_case(case_dir, build_dir)
+        exe = exe_cache.cached_executable(build_dir, env, cache_dir=cache_dir)
+
+        for scale in scales:
+            rundir = os.path.join(workdir, '%s_s%s' % (case, scale))
+            t_startup = startup_wall(exe, case_dir, rundir, env, scale)
+            reference = None
+            for interval in sorted(intervals):
+                print("%s: scale %s, checkpt_interval %s" \
+                        % (case, scale, interval if interval > 0 else 'none'))
+                result = benchmark_run(exe, case_dir, rundir, env, scale,
+                                       interval, repeat)
+                result['startup_wall'] = t_startup
+                if interval == 0:
+                    reference = result
+                if result.get('restart_read_return_code') == 0:
+                    result['restart_read_seconds'] = \
+                            result['restart_wall'] - t_startup
+                if reference is not None and interval > 0 \
+                        and reference['final_hash'] is not None:
+                    result['overhead_seconds'] = \
+                            result['wall'] - reference['wall']
+                    result['overhead_fraction'] = \
+                            result['overhead_seconds'] / reference['wall']
+                    result['bitwise_equal'] = \
+                            result['final_hash'] == reference['final_hash']
+                    if 'restart_return_code' in result:
+                        # a failed restart counts as a difference
+                        result['restart_bitwise_equal'] = \
+                                result['restart_return_code'] == 0 \
+                                and result['restart_final_hash'] \
+                                == reference['final_hash']
+                results.append(result)
+
+    return {'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'host': socket.gethostname(),
+            'clawpack_version': clawpack_version(),
+            'CLAW': env.get('CLAW'),
+            'num_threads': num_threads,
+            'repeat': repeat,
+            'results': results}
+
+
+def print_summary(benchmark_results):
+    print("%-28s %5s %8s %9s %9s %8s %9s %8s" \
+            % ('case', 'scale', 'interval', 'wall (s)', 'overhead', 'chk MB',
+               'read (s)', 'bitwise'))
+    for r in benchmark_results['results']:
+        def fmt(key, f):
+            return f % r[key] if r.get(key) is not None else '-'
+        bitwise = '-'
+        if 'bitwise_equal' in r:
+            bitwise = 'yes' if r['bitwise_equal'] \
+                      and r.get('restart_bitwise_equal', True) else 'NO'
+        print("%-28s %5s %8s %9s %9s %8s %9s %8s" \
+                % (r['case'], r['scale'], r['checkpt_interval'] or 'none',
+                   fmt('wall', '%.2f'),
+                   '%.1f%%' % (100*r['overhead_fraction'])
+                   if r.get('overhead_fraction') is not None else '-',
+                   '%.1f' % (r['checkpoint_bytes'] / 2.**20)
+                   if r.get('checkpoint_bytes') is not None else '-',
+                   fmt('restart_read_seconds', '%.3f'), bitwise))
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Benchmark checkpoint and restart overhead.")
+    parser.add_argument('--cases', nargs='+', default=cases_default,
+        help="case directories to benchmark")
+    parser.add_argument('--intervals', nargs='+', type=int,
+        default=[0, 20, 10, 5],
+        help="checkpt_interval values (level 1 steps), 0 for no checkpoints")
+    parser.add_argument('--scales', nargs='+', type=int, default=[1, 2],
+        help="factors to multiply num_cells by")
+    parser.add_argument('--threads', type=int, default=3,
+        help="OMP_NUM_THREADS for every run")
+    parser.add_argument('--repeat', type=int, default=1,
+        help="number of times to repeat each run, keeping the fastest")
+    parser.add_argument('--workdir', default='_benchmark',
+        help="directory for the copies of the cases")
+    parser.add_argument('--json', default='benchmark_checkpoint.json',
+        help="file to write the results to")
+    args = parser.parse_args()
+
+    results = benchmark(args.cases, args.intervals, args.scales,
+                        args.threads, args.repeat, args.workdir)
+    checkpoint_manifest.write_json_atomic(args.json, results)
+    print_summary(results)
+    print("Results written to %s" % args.json)
+    if any(r.get('bitwise_equal') is False
+           or r.get('restart_bitwise_equal') is False
+           for r in results['results']):
+        sys.exit(1)
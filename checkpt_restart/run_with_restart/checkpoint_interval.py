@@ -0,0 +1,219 @@
+"""
+Adaptive choice of the checkpoint interval for run_with_restart.py.
+
+The interval between checkpoints that minimizes the expected wall time lost
+to interruptions plus the time spent writing checkpoints is given by Daly's
+higher order estimate,
+
+    tau = sqrt(2*C*M) * (1 + sqrt(C/(2*M))/3 + C/(18*M)) - C    if C < 2*M,
+    tau = M                                                     otherwise,
+
+where C is the time to write one checkpoint and M is the mean time between
+interruptions, both in wall-clock seconds.  For C much smaller than M this
+is Young's sqrt(2*C*M).
+
+C is measured while the job runs by a CheckpointTimer, which notices when a
+checkpoint file starts being written and when its time stamp file fort.tckXXXXX
+appears (checkpoints too small to be timed this way are costed from their size
+and the measured write bandwidth).  M is estimated from the attempts recorded
+in the restart state (see run_with_restart.py).  The wall time tau is converted to level 1 time
+steps (checkpt_style 3) or to a list of checkpoint times (checkpt_style 2)
+using the pace of the run observed between checkpoints.
+"""
+
+import os
+import glob
+import time
+import math
+
+import checkpoint_manifest
+
+
+class CheckpointTimer(object):
+    """
+    Measure how long each checkpoint takes to write by polling outdir.
+
+    A checkpoint fort.chkXXXXX is being written while its time stamp file
+    fort.tckXXXXX is missing or older than it.  The duration is measured from
+    the first call to check() that sees this until the first call that sees
+    the time stamp file updated, so it is only as accurate as the polling
+    interval; checkpoints written entirely between two calls are recorded
+    with seconds = None.  Completed writes are appended to self.writes.
+    """
+
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.pending = {}
+        self.writes = []
+        self.seen = {}
+        for suffix, chk_mtime, tck_mtime in self._scan():
+            self.seen[suffix] = tck_mtime
+
+    def _scan(self):
+        for chkfile in glob.glob(os.path.join(self.outdir, 'fort.chk*')):
+            suffix = os.path.basename(chkfile)[len('fort.chk'):]
+            if '.' in suffix:
+                continue
+            try:
+                chk_mtime = os.path.getmtime(chkfile)
+            except OSError:
+                continue
+            try:
+                tck_mtime = os.path.getmtime(
+                        os.path.join(self.outdir, 'fort.tck' + suffix))
+            except OSError:
+                tck_mtime = None
+            yield suffix, chk_mtime, tck_mtime
+
+    def check(self):
+        now = time.time()
+        for suffix, chk_mtime, tck_mtime in self._scan():
+            if tck_mtime is None or chk_mtime > tck_mtime:
+                self.pending.setdefault(suffix, now)
+                continue
+            if self.seen.get(suffix) == tck_mtime:
+                continue
+            self.seen[suffix] = tck_mtime
+            start = self.pending.pop(suffix, None)
+            try:
+                t, step = checkpoint_manifest.read_tck(
+                        os.path.join(self.outdir, 'fort.tck' + suffix))
+                size = os.path.getsize(
+                        os.path.join(self.outdir, 'fort.chk' + suffix))
+            except (IOError, OSError, ValueError, IndexError):
+                continue
+            self.writes.append({'suffix': suffix, 'size': size,
+                                'seconds': (now - start
+                                            if start is not None else None),
+                                'time': t, 'step': step, 'wall': now})
+
+
+def measure_write_bandwidth(outdir, nbytes=8*2**20):
+    """
+    Time writing (and syncing) nbytes to a scratch file in outdir and return
+    the bandwidth in bytes per second.
+    """
+
+    fname = os.path.join(outdir, '.bandwidth_probe')
+    block = os.urandom(2**20)
+    start = time.time()
+    with open(fname, 'wb') as f:
+        for i in range(nbytes // len(block)):
+            f.write(block)
+        f.flush()
+        os.fsync(f.fileno())
+    seconds = max(time.time() - start, 1e-6)
+    os.remove(fname)
+    return nbytes / seconds
+
+
+def optimal_interval(cost, mtbf):
+    """
+    Daly's optimal wall time between checkpoints for a checkpoint cost and a
+    mean time between interruptions mtbf, both in seconds.
+    """
+
+    if cost >= 2. * mtbf:
+        return mtbf
+    ratio = cost / (2. * mtbf)
+    return math.sqrt(2. * cost * mtbf) \
+            * (1. + math.sqrt(ratio) / 3. + ratio / 9.) - cost
+
+
+def checkpoint_cost(state, outdir):
+    """
+    Mean time in seconds to write a checkpoint, from the writes recorded in
+    the restart state.  If all of them were too quick to be timed by polling,
+    the cost is estimated from their mean size and the write bandwidth to
+    outdir.  Returns None if no checkpoints have been recorded.
+    """
+
+    writes = state.get('checkpoint_writes', [])
+    seconds = [w['seconds'] for w in writes if w['seconds'] is not None]
+    if len(seconds) > 0:
+        return sum(seconds) / len(seconds)
+    if len(writes) == 0:
+        return None
+    size = sum(w['size'] for w in writes) / len(writes)
+    return size / measure_write_bandwidth(outdir)
+
+
+def mean_time_between_interruptions(state):
+    """
+    Total wall time of the attempts recorded in the restart state divided by
+    the number of them that were interrupted, or None if none were.
+    """
+
+    attempts = [a for a in state.get('attempts', []) if a.get('end')]
+    interrupted = [a for a in attempts if a.get('return_code') != 0]
+    if len(interrupted) == 0:
+        return None
+    wall = sum(a['end'] - a['start'] for a in attempts)
+    return wall / len(interrupted)
+
+
+def run_pace(state):
+    """
+    Return (wall seconds per level 1 step, wall seconds per unit of simulated
+    time) from consecutive checkpoints written during the same attempt, using
+    the most recent pair.  Either value is None if it cannot be determined.
+    """
+
+    writes = state.get('checkpoint_writes', [])
+    per_step = per_time = None
+    for w0, w1 in zip(writes[:-1], writes[1:]):
+        if w0.get('attempt') != w1.get('attempt'):
+            continue
+        dwall = w1['wall'] - w0['wall']
+        if dwall <= 0:
+            continue
+        if w0['step'] is not None and w1['step'] is not None \
+                and w1['step'] > w0['step']:
+            per_step = dwall / (w1['step'] - w0['step'])
+        if w1['time'] > w0['time']:
+            per_time = dwall / (w1['time'] - w0['time'])
+    return per_step, per_time
+
+
+def tune_checkpoint_interval(clawdata, state, outdir, t_restart, tfinal):
+    """
+    Reset the checkpoint interval in clawdata (checkpt_interval for
+    checkpt_style 3, checkpt_times for checkpt_style 2) to the one that
+    minimizes the expected lost work plus checkpoint overhead.
+
+    Returns a message describing what was done, or None if there was not
+    enough information (or the checkpt_style has no interval to tune).
+    """
+
+    style = abs(clawdata.checkpt_style)
+    if style not in (2, 3):
+        return None
+
+    cost = checkpoint_cost(state, outdir)
+    mtbf = mean_time_between_interruptions(state)
+    per_step, per_time = run_pace(state)
+    if cost is None or mtbf is None:
+        return None
+
+    tau = optimal_interval(cost, mtbf)
+    msg = "Checkpoint cost %.3g s, mean time between interruptions %.3g s, " \
+          % (cost, mtbf) + "optimal interval %.3g s of wall time" % tau
+
+    if style == 3:
+        if per_step is None:
+            return None
+        clawdata.checkpt_interval = max(1, int(round(tau / per_step)))
+        msg += ": checkpt_interval = %s steps" % clawdata.checkpt_interval
+    else:
+        if per_time is None:
+            return None
+        dt = tau / per_time
+        times = []
+        t = t_restart + dt
+        while t < tfinal:
+            times.append(t)
+            t += dt
+        clawdata.checkpt_times = times
+        msg += ": %s checkpt_times spaced by %.4g" % (len(times), dt)
+
+    return msg
@@ -0,0 +1,215 @@
+"""
+Checkpoint manifest for an AMRClaw output directory.
+
+The manifest is a small JSON file `checkpoint_manifest.json` in the output
+directory recording the time, step, size and checksum of every complete
+checkpoint file found there, for any value of clawdata.checkpt_style:
+
+ - the two alternating files fort.chkaaaaa and fort.chkbbbbb (checkpt_style < 0),
+ - the numbered files fort.chkNNNNN (checkpt_style > 0).
+
+Each checkpoint file fort.chkXXXXX is accompanied by a small time stamp file
+fort.tckXXXXX that AMRClaw writes only after the checkpoint itself has been
+written, so a checkpoint is considered complete if its .tck file exists and
+is not older than the checkpoint file.
+
+A checkpoint that has been compressed to fort.chkXXXXX.gz keeps its entry
+(with 'compressed' set to True) as long as the .gz file exists.
+
+Entries are only re-parsed and re-checksummed when the files have changed
+since the manifest was last written, and the manifest is replaced atomically
+so that a reader never sees a partially written file.
+"""
+
+import os
+import glob
+import json
+import hashlib
+import threading
+
+manifest_name = 'checkpoint_manifest.json'
+
+# Only one thread of a process should update a given manifest at a time:
+_manifest_lock = threading.Lock()
+
+
+def write_json_atomic(fname, data):
+    """
+    Write data as JSON to fname by writing a temporary file in the same
+    directory and renaming it, so the file is replaced atomically.
+    """
+
+    tmpname = '%s.tmp%s' % (fname, os.getpid())
+    with open(tmpname, 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmpname, fname)
+
+
+def read_json(fname, default=None):
+    """
+    Read JSON from fname, returning default if it is missing or unreadable.
+    """
+
+    try:
+        with open(fname) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def file_checksum(fname, blocksize=2**20):
+    """
+    Return the sha256 checksum of a file, read in blocks of blocksize bytes.
+    """
+
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        while True:
+            block = f.read(blocksize)
+            if not block:
+                break
+            h.update(block)
+    return 'sha256:' + h.hexdigest()
+
+
+def read_tck(fname):
+    """
+    Read the time and step number from a fort.tckXXXXX file, which has
+    lines of the form
+
+         Checkpoint file at time t =    0.1600000000E+00
+         alloc size isize =     4000000
+         Number of steps taken =     11
+
+    Returns (time, step), with step = None if it is not recorded.
+    """
+
+    with open(fname) as f:
+        lines = f.readlines()
+    if '=' in lines[0]:
+        t = float(lines[0].split('=')[-1])
+    else:
+        t = float(lines[0][29:])
+    step = None
+    for line in lines[1:]:
+        if 'steps' in line and '=' in line:
+            step = int(line.split('=')[-1])
+    return t, step
+
+
+def read_tail(fname, nbytes=4096):
+    """
+    Return the last nbytes of a file as text, without reading the rest.
+    """
+
+    with open(fname, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - nbytes))
+        return f.read().decode('ascii', 'replace')
+
+
+def run_finished(outdir='_output'):
+    """
+    Check whether the run in outdir has finished, by examining the last line
+    of fort.amr for the ending message.  Only the tail of the file is read
+    since fort.amr can be very large for long runs.
+    """
+
+    fortamr = os.path.join(outdir, 'fort.amr')
+    try:
+        lines = [line for line in read_tail(fortamr).splitlines()
+                 if line.strip()]
+    except (IOError, OSError):
+        return False
+    return len(lines) > 0 and ('end of' in lines[-1])
+
+
+def update_manifest(outdir='_output'):
+    """
+    Scan outdir for checkpoint files, update the manifest to describe all of
+    them and return it as a dictionary.  The 'checkpoints' entry is keyed by
+    the checkpoint suffix XXXXX of fort.chkXXXXX.
+    """
+
+    fname = os.path.join(outdir, manifest_name)
+
+    with _manifest_lock:
+        manifest = read_json(fname, default={})
+        old_entries = manifest.get('checkpoints', {})
+        entries = {}
+
+        for tckfile in sorted(glob.glob(os.path.join(outdir, 'fort.tck*'))):
+            suffix = os.path.basename(tckfile)[len('fort.tck'):]
+            if '.' in suffix:
+                continue   # e.g. a temporary or backup copy
+            chkname = 'fort.chk' + suffix
+            chkfile = os.path.join(outdir, chkname)
+            old = old_entries.get(suffix)
+            try:
+                tck_stat = os.stat(tckfile)
+                chk_stat = os.stat(chkfile)
+            except OSError:
+                # the checkpoint may have been compressed since it was
+                # recorded (see checkpoint_retention.py):
+                gzfile = chkfile + '.gz'
+                if old is not None and os.path.exists(gzfile):
+                    entry = dict(old)
+                    entry['compressed'] = True
+                    entry['gz_size'] = os.path.getsize(gzfile)
+                    entries[suffix] = entry
+                continue
+
+            if old is not None and old.get('tck_mtime') == tck_stat.st_mtime \
+                    and old.get('mtime') == chk_stat.st_mtime \
+                    and old.get('size') == chk_stat.st_size:
+                entry = dict(old)
+                entry['compressed'] = False
+                entry.pop('gz_size', None)
+                entries[suffix] = entry
+                continue
+
+            try:
+                t, step = read_tck(tckfile)
+            except (IOError, OSError, ValueError, IndexError):
+                continue
+
+            complete = (chk_stat.st_mtime <= tck_stat.st_mtime)
+            entries[suffix] = {'chk': chkname,
+                               'tck': os.path.basename(tckfile),
+                               'time': t,
+                               'step': step,
+                               'size': chk_stat.st_size,
+                               'mtime': chk_stat.st_mtime,
+                               'tck_mtime': tck_stat.st_mtime,
+                               'complete': complete,
+                               'compressed': False,
+                               'checksum': (file_checksum(chkfile)
+                                            if complete else None)}
+
+        manifest['checkpoints'] = entries
+        if entries != old_entries or not os.path.exists(fname):
+            if os.path.isdir(outdir):
+                write_json_atomic(fname, manifest)
+
+    return manifest
+
+
+def latest_checkpoint(manifest):
+    """
+    Return (suffix, entry) for the complete checkpoint in manifest with the
+    largest time (and step, for ties), or (None, None) if there is none.
+    """
+
+    latest = (None, None)
+    key = None
+    for suffix, entry in manifest.get('checkpoints', {}).items():
+        if not entry.get('complete'):
+            continue
+        k = (entry['time'], entry['step'] if entry['step'] is not None else -1)
+        if key is None or k > key:
+            key = k
+            latest = (suffix, entry)
+    return latest
@@ -0,0 +1,144 @@
+"""
+Compression and retention policy for the numbered checkpoint files
+fort.chkNNNNN written with checkpt_style 2 or 3, which otherwise accumulate
+in the output directory without limit.
+
+Of the complete checkpoints recorded in the checkpoint manifest, ordered from
+newest to oldest:
+
+ - the newest keep_uncompressed are left alone,
+ - the next keep_compressed are compressed to fort.chkNNNNN.gz,
+ - the rest are deleted (along with their fort.tckNNNNN files).
+
+The alternating files fort.chkaaaaa and fort.chkbbbbb are never touched.
+
+CheckpointCompressor applies this policy periodically in a background thread
+while the code is running, and restore_checkpoint decompresses a checkpoint
+again before it is used for a restart.
+"""
+
+import os
+import gzip
+import shutil
+import threading
+
+import checkpoint_manifest
+
+
+def compress_checkpoint(outdir, suffix):
+    """
+    Compress fort.chkNNNNN to fort.chkNNNNN.gz and remove the original.
+    """
+
+    chkfile = os.path.join(outdir, 'fort.chk' + suffix)
+    gzfile = chkfile + '.gz'
+    tmpfile = gzfile + '.tmp'
+    with open(chkfile, 'rb') as fin:
+        with gzip.open(tmpfile, 'wb', compresslevel=6) as fout:
+            shutil.copyfileobj(fin, fout, 2**20)
+    os.replace(tmpfile, gzfile)
+    os.remove(chkfile)
+
+
+def restore_checkpoint(outdir, suffix):
+    """
+    If checkpoint fort.chk<suffix> has been compressed, decompress it in
+    place, check it against the checksum in the manifest and give it back
+    its original modification time so the manifest still considers it
+    complete.  Does nothing if the checkpoint is not compressed.
+    """
+
+    manifest = checkpoint_manifest.update_manifest(outdir)
+    entry = manifest.get('checkpoints', {}).get(suffix)
+    if entry is None or not entry.get('compressed'):
+        return
+
+    chkfile = os.path.join(outdir, 'fort.chk' + suffix)
+    gzfile = chkfile + '.gz'
+    tmpfile = chkfile + '.tmp'
+    with gzip.open(gzfile, 'rb') as fin:
+        with open(tmpfile, 'wb') as fout:
+            shutil.copyfileobj(fin, fout, 2**20)
+
+    checksum = checkpoint_manifest.file_checksum(tmpfile)
+    if checksum != entry['checksum']:
+        os.remove(tmpfile)
+        raise IOError("Checksum of decompressed %s does not match manifest" \
+                % gzfile)
+
+    os.utime(tmpfile, (entry['mtime'], entry['mtime']))
+    os.replace(tmpfile, chkfile)
+    os.remove(gzfile)
+    checkpoint_manifest.update_manifest(outdir)
+
+
+def apply_retention(outdir, keep_uncompressed=1, keep_compressed=3):
+    """
+    Apply the retention policy described above to the checkpoints in outdir.
+    Returns a list of (action, suffix) pairs describing what was done.
+    """
+
+    manifest = checkpoint_manifest.update_manifest(outdir)
+    numbered = [(entry['time'], suffix)
+                for suffix, entry in manifest.get('checkpoints', {}).items()
+                if suffix.isdigit() and entry.get('complete')]
+    numbered.sort(reverse=True)
+
+    actions = []
+    for n, (t, suffix) in enumerate(numbered):
+        entry = manifest['checkpoints'][suffix]
+        if n < keep_uncompressed:
+            continue
+        elif n < keep_uncompressed + keep_compressed:
+            if not entry.get('compressed'):
+                compress_checkpoint(outdir, suffix)
+                actions.append(('compressed', suffix))
+        else:
+            for fname in ['fort.chk' + suffix, 'fort.chk' + suffix + '.gz',
+                          'fort.tck' + suffix]:
+                fname = os.path.join(outdir, fname)
+                if os.path.exists(fname):
+                    os.remove(fname)
+            actions.append(('deleted', suffix))
+
+    if actions:
+        checkpoint_manifest.update_manifest(outdir)
+    return actions
+
+
+class CheckpointCompressor(threading.Thread):
+    """
+    Background thread applying the retention policy to outdir every
+    interval seconds until stop() is called, and once more after that.
+    """
+
+    def __init__(self, outdir, keep_uncompressed=1, keep_compressed=3,
+                 interval=30., log=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.outdir = outdir
+        self.keep_uncompressed = keep_uncompressed
+        self.keep_compressed = keep_compressed
+        self.interval = interval
+        self.log = log
+        self._stop_event = threading.Event()
+
+    def apply(self):
+        try:
+            actions = apply_retention(self.outdir, self.keep_uncompressed,
+                                      self.keep_compressed)
+        except (IOError, OSError) as e:
+            actions = [('error: %s' % e, '')]
+        if self.log is not None:
+            for action, suffix in actions:
+                self.log("Checkpoint retention: %s fort.chk%s" \
+                        % (action, suffix))
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.apply()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.apply()
@@ -0,0 +1,230 @@
+"""
+Staging of output and checkpoints on node-local storage for
+run_with_restart.py.
+
+With a staging directory (e.g. on local NVMe or tmpfs), the code writes its
+output there instead of in _output, which may be on a slow shared
+filesystem.  A CheckpointDrain thread copies the output to _output in the
+background:
+
+ - each complete checkpoint (see checkpoint_manifest.py) is copied to a
+   temporary file, verified against the checksum in the staging manifest
+   and renamed, and only then is its fort.tckXXXXX time stamp file copied,
+   so _output never has a checkpoint that looks complete but is not,
+ - all other files (frames, gauges, fort.amr, ...) are copied whenever they
+   have changed.
+
+With a retention policy (see checkpoint_retention.py), CheckpointDrain
+applies it to the staging directory before each drain, so only the
+checkpoints kept uncompressed are copied, and to _output after it, so
+_output holds the same checkpoints as the staging directory.
+
+On restart, select_checkpoint picks the newest complete checkpoint found in
+either directory, copying it (and the other output needed to continue the
+run) to the staging directory if it is only found in _output, e.g. after
+the node holding the staging directory was lost.
+"""
+
+import os
+import shutil
+import hashlib
+import threading
+
+import checkpoint_manifest
+from checkpoint_retention import apply_retention
+
+# bookkeeping files each directory keeps for itself:
+local_files = [checkpoint_manifest.manifest_name, 'restart_state.json',
+               'telemetry_state.json', 'telemetry.csv']
+
+
+def staging_outdir(staging, rundir='.'):
+    """
+    Output directory for the case in rundir under the staging directory,
+    made unique by a hash of the absolute path of rundir so that several
+    cases can share the same staging directory.
+    """
+
+    rundir = os.path.abspath(rundir)
+    key = hashlib.sha1(rundir.encode()).hexdigest()[:8]
+    return os.path.join(os.path.abspath(staging),
+                        '%s_%s' % (os.path.basename(rundir), key))
+
+
+def _is_checkpoint_file(fname):
+    return fname.startswith('fort.chk') or fname.startswith('fort.tck')
+
+
+def _changed(src, dst):
+    try:
+        s = os.stat(src)
+        d = os.stat(dst)
+    except OSError:
+        return True
+    return s.st_size != d.st_size or s.st_mtime != d.st_mtime
+
+
+def _copy_atomic(src, dst):
+    tmpname = dst + '.tmp'
+    shutil.copy2(src, tmpname)
+    os.replace(tmpname, dst)
+    return tmpname
+
+
+def drain_checkpoint(staging, durable, suffix, entry):
+    """
+    Copy one complete checkpoint from staging to durable, verifying its
+    checksum before its time stamp file is copied.
+    """
+
+    src = os.path.join(staging, entry['chk'])
+    dst = os.path.join(durable, entry['chk'])
+    tmpname = dst + '.tmp'
+    shutil.copy2(src, tmpname)
+    if checkpoint_manifest.file_checksum(tmpname) != entry['checksum']:
+        os.remove(tmpname)
+        raise IOError("Checksum mismatch copying %s to %s" % (src, durable))
+    os.replace(tmpname, dst)
+    _copy_atomic(os.path.join(staging, entry['tck']),
+                 os.path.join(durable, entry['tck']))
+
+
+def drain(staging, durable):
+    """
+    Copy new or changed output from staging to durable.  Returns the list
+    of checkpoint suffixes drained.
+    """
+
+    if not os.path.isdir(staging):
+        return []
+    if not os.path.isdir(durable):
+        os.makedirs(durable)
+
+    drained = []
+    staged = checkpoint_manifest.update_manifest(staging)
+    for suffix, entry in staged.get('checkpoints', {}).items():
+        if not entry['complete'] or entry.get('compressed'):
+            continue
+        if _changed(os.path.join(staging, entry['tck']),
+                    os.path.join(durable, entry['tck'])):
+            drain_checkpoint(staging, durable, suffix, entry)
+            drained.append(suffix)
+    if drained:
+        checkpoint_manifest.update_manifest(durable)
+
+    for fname in os.listdir(staging):
+        src = os.path.join(staging, fname)
+        if _is_checkpoint_file(fname) or fname in local_files \
+                or '.tmp' in fname or not os.path.isfile(src):
+            continue
+        dst = os.path.join(durable, fname)
+        if _changed(src, dst):
+            _copy_atomic(src, dst)
+
+    return drained
+
+
+def stage_in(durable, staging, latest):
+    """
+    Copy checkpoint fort.chk<latest> and the other output files that are
+    missing from staging (gauge files to be appended to, fort.amr, ...)
+    from durable to staging, so the code can be restarted there.
+    """
+
+    if not os.path.isdir(staging):
+        os.makedirs(staging)
+    for fname in os.listdir(durable):
+        src = os.path.join(durable, fname)
+        if fname in local_files or '.tmp' in fname or not os.path.isfile(src):
+            continue
+        if _is_checkpoint_file(fname) \
+                and fname[len('fort.chk'):].split('.')[0] != latest:
+            continue
+        dst = os.path.join(staging, fname)
+        if not os.path.exists(dst) or _is_checkpoint_file(fname):
+            _copy_atomic(src, dst)
+    checkpoint_manifest.update_manifest(staging)
+
+
+def select_checkpoint(durable, staging):
+    """
+    Return (finished, latest, t_latest) as examine_outdir does, choosing
+    the newest complete checkpoint in either durable or staging and staging
+    it in if it is only in durable.
+    """
+
+    finished = checkpoint_manifest.run_finished(durable) \
+               or checkpoint_manifest.run_finished(staging)
+
+    candidates = []
+    for outdir in [staging, durable]:
+        manifest = checkpoint_manifest.update_manifest(outdir)
+        suffix, entry = checkpoint_manifest.latest_checkpoint(manifest)
+        if suffix is not None:
+            candidates.append((entry['time'], outdir == staging, suffix))
+
+    if len(candidates) == 0:
+        return finished, None, None
+
+    t_latest, in_staging, latest = max(candidates)
+    if not in_staging:
+        print("Copying checkpoint %s at t = %s from %s to %s" \
+                % (latest, t_latest, durable, staging))
+        stage_in(durable, staging, latest)
+    return finished, latest, t_latest
+
+
+class CheckpointDrain(threading.Thread):
+    """
+    Background thread draining staging to durable every interval seconds
+    until stop() is called, after which everything is drained once more.
+    If retention is given as (keep_uncompressed, keep_compressed), the
+    retention policy is applied to staging before each drain and to durable
+    after it.
+    """
+
+    def __init__(self, staging, durable, interval=30., log=None,
+                 retention=None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.staging = staging
+        self.durable = durable
+        self.interval = interval
+        self.log = log
+        self.retention = retention
+        self._stop_event = threading.Event()
+
+    def apply_retention(self, outdir):
+        try:
+            actions = apply_retention(outdir, *self.retention)
+        except (IOError, OSError) as e:
+            actions = [('error: %s' % e, '')]
+        if self.log is not None:
+            for action, suffix in actions:
+                self.log("Checkpoint retention: %s %s" \
+                        % (action, os.path.join(outdir, 'fort.chk' + suffix)))
+
+    def apply(self):
+        if self.retention is not None:
+            self.apply_retention(self.staging)
+        try:
+            drained = drain(self.staging, self.durable)
+        except (IOError, OSError) as e:
+            if self.log is not None:
+                self.log("Checkpoint drain: error: %s" % e)
+            return
+        if self.log is not None:
+            for suffix in drained:
+                self.log("Checkpoint drain: copied fort.chk%s to %s" \
+                        % (suffix, self.durable))
+        if self.retention is not None:
+            self.apply_retention(self.durable)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.apply()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.apply()
@@ -0,0 +1,206 @@
+"""
+Post-run compactor for output produced by a sequence of restarts.
+
+When the code is restarted from a checkpoint at time t_chk, the gauge
+records between t_chk and the time the previous run died are computed again
+and appended to the gauge*.txt files, so they appear twice.  Output frames
+may also have been written more than once for the same time.
+
+This script builds a single time-ordered catalog of frames and gauge records
+across all restart segments and writes a deduplicated copy to a compact
+directory (by default _output/_compact):
+
+ - gaugeNNNNN.txt with the same header and the overlapping records of
+   earlier segments dropped (the records from the restarted run are kept),
+ - gaugeNNNNN.npy with the same records as a binary array, one row per
+   record, that can be loaded (or memory-mapped) with numpy.load,
+ - the frame files fort.qXXXX, fort.tXXXX, etc. renumbered in order of
+   increasing time with duplicate times removed (hard links when possible),
+ - catalog.json describing all of the above.
+
+Usage:
+
+    python compact_output.py [outdir [compact_dir]]
+"""
+
+import os
+import re
+import glob
+import shutil
+from array import array
+
+import numpy
+from numpy.lib.format import open_memmap
+
+import checkpoint_manifest
+
+frame_file_regexp = re.compile(r'fort\.([a-z])(\d{4,})$')
+
+
+def read_gauge_times(fname, time_column=1):
+    """
+    Return (header lines, array of record times, number of columns) for a
+    gauge file, reading it one line at a time.
+    """
+
+    header = []
+    times = array('d')
+    num_columns = 0
+    with open(fname) as f:
+        for line in f:
+            if line.startswith('#'):
+                if len(times) == 0:
+                    header.append(line)
+                continue
+            fields = line.split()
+            if len(fields) == 0:
+                continue
+            num_columns = len(fields)
+            times.append(float(fields[time_column]))
+    return header, times, num_columns
+
+
+def dedup_mask(times):
+    """
+    Return a bytearray with 1 for each record to keep.  Whenever the time
+    decreases a new restart segment starts, and the records of earlier
+    segments at or after its starting time are dropped.
+    """
+
+    keep = bytearray([1]) * len(times)
+    for i in range(1, len(times)):
+        if times[i] < times[i-1]:
+            t_restart = times[i]
+            j = i - 1
+            while j >= 0:
+                if keep[j]:
+                    if times[j] < t_restart:
+                        break
+                    keep[j] = 0
+                j -= 1
+    return keep
+
+
+def compact_gauge(fname, compact_dir, time_column=1):
+    """
+    Write the deduplicated text and .npy versions of one gauge file to
+    compact_dir and return its catalog entry.
+    """
+
+    header, times, num_columns = read_gauge_times(fname, time_column)
+    keep = dedup_mask(times)
+    num_kept = sum(keep)
+
+    base = os.path.splitext(os.path.basename(fname))[0]
+    txtname = os.path.join(compact_dir, base + '.txt')
+    npyname = os.path.join(compact_dir, base + '.npy')
+    records = open_memmap(npyname, mode='w+', dtype=numpy.float64,
+                          shape=(num_kept, num_columns))
+
+    n = 0
+    k = 0
+    with open(fname) as fin, open(txtname, 'w') as fout:
+        fout.writelines(header)
+        for line in fin:
+            if line.startswith('#') or len(line.split()) == 0:
+                continue
+            if keep[n]:
+                fout.write(line)
+                records[k, :] = [float(x) for x in line.split()]
+                k += 1
+            n += 1
+    records.flush()
+    del records
+
+    kept_times = [t for t, flag in zip(times, keep) if flag]
+    return {'file': os.path.basename(fname),
+            'txt': os.path.basename(txtname),
+            'npy': os.path.basename(npyname),
+            'num_records': num_kept,
+            'duplicates_dropped': len(times) - num_kept,
+            't_min': min(kept_times) if kept_times else None,
+            't_max': max(kept_times) if kept_times else None}
+
+
+def frame_catalog(outdir):
+    """
+    Return a list of (time, frame number) for the frames in outdir, sorted by
+    time, keeping only the most recently written frame for any given time.
+    """
+
+    by_time = {}
+    for tfile in glob.glob(os.path.join(outdir, 'fort.t*')):
+        m = frame_file_regexp.match(os.path.basename(tfile))
+        if m is None or m.group(1) != 't':
+            continue
+        try:
+            with open(tfile) as f:
+                t = float(f.readline().split()[0])
+        except (IOError, OSError, ValueError, IndexError):
+            continue
+        frameno = int(m.group(2))
+        mtime = os.path.getmtime(tfile)
+        if t not in by_time or mtime > by_time[t][1]:
+            by_time[t] = (frameno, mtime)
+    return [(t, by_time[t][0]) for t in sorted(by_time)]
+
+
+def _link_or_copy(src, dst):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def compact_output(outdir='_output', compact_dir=None):
+    """
+    Write the compacted frames and gauges of outdir to compact_dir and
+    return the catalog, which is also saved as compact_dir/catalog.json.
+    """
+
+    if compact_dir is None:
+        compact_dir = os.path.join(outdir, '_compact')
+    if not os.path.isdir(compact_dir):
+        os.makedirs(compact_dir)
+
+    frame_files = {}
+    for fname in os.listdir(outdir):
+        m = frame_file_regexp.match(fname)
+        if m is not None:
+            frame_files.setdefault(int(m.group(2)), []).append(
+                    (m.group(1), len(m.group(2)), fname))
+
+    frames = []
+    for new_frameno, (t, frameno) in enumerate(frame_catalog(outdir)):
+        files = []
+        for letter, ndigits, fname in frame_files.get(frameno, []):
+            new_name = 'fort.%s%s' % (letter, str(new_frameno).zfill(ndigits))
+            _link_or_copy(os.path.join(outdir, fname),
+                          os.path.join(compact_dir, new_name))
+            files.append(new_name)
+        frames.append({'frame': new_frameno, 'time': t,
+                       'original_frame': frameno, 'files': sorted(files)})
+
+    gauges = []
+    for fname in sorted(glob.glob(os.path.join(outdir, 'gauge*.txt'))):
+        gauges.append(compact_gauge(fname, compact_dir))
+
+    catalog = {'outdir': os.path.abspath(outdir),
+               'frames': frames,
+               'gauges': gauges}
+    checkpoint_manifest.write_json_atomic(
+            os.path.join(compact_dir, 'catalog.json'), catalog)
+    return catalog
+
+
+if __name__ == '__main__':
+
+    import sys
+    catalog = compact_output(*sys.argv[1:])
+    print("%s frames, %s gauges" % (len(catalog['frames']),
+                                    len(catalog['gauges'])))
+    for g in catalog['gauges']:
+        print("%s: %s records, %s duplicates dropped" \
+                % (g['file'], g['num_records'], g['duplicates_dropped']))
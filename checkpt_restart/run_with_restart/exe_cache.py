@@ -0,0 +1,149 @@
+"""
+Cache of compiled executables for the direct-exec mode of run_with_restart.py.
+
+Rather than going through `make output` (which re-checks all dependencies,
+may regenerate the data files with setrun.py and then calls runclaw.py), the
+executable is looked up in a cache directory by a hash of everything it is
+built from, and only rebuilt, with `make new`, when that hash changes.
+
+The hash covers:
+
+ - the Makefile in the run directory and every Fortran source file there,
+ - the files and directories named in the Makefile through $(CLAW) or other
+   variables (e.g. the AMRClaw library sources),
+ - the compiler settings FC, FFLAGS and LFLAGS from the environment and
+   the value of CLAW.
+"""
+
+import os
+import re
+import glob
+import shutil
+import hashlib
+import subprocess
+
+fortran_extensions = ('.f', '.f90', '.F', '.F90', '.f95', '.F95')
+
+
+def read_makefile_vars(rundir='.'):
+    """
+    Return a dictionary of the simple `NAME = value` (or `?=`) assignments
+    in rundir/Makefile, with comments removed.
+    """
+
+    makevars = {}
+    with open(os.path.join(rundir, 'Makefile')) as f:
+        for line in f:
+            line = line.split('#')[0]
+            m = re.match(r'\s*([A-Za-z_][A-Za-z0-9_]*)\s*\??=\s*(.*)$', line)
+            if m:
+                makevars[m.group(1)] = m.group(2).strip()
+    return makevars
+
+
+def _expand(text, makevars, env):
+    """
+    Expand $(NAME) references in text using makevars, then env.
+    """
+
+    def lookup(m):
+        name = m.group(1)
+        if name in makevars:
+            return _expand(makevars[name], makevars, env)
+        return env.get(name, '')
+    return re.sub(r'\$\(([A-Za-z_][A-Za-z0-9_]*)\)', lookup, text)
+
+
+def source_files(rundir='.', env=None):
+    """
+    Return the sorted list of files the executable in rundir is built from.
+    """
+
+    if env is None:
+        env = os.environ
+    makevars = read_makefile_vars(rundir)
+
+    fnames = set([os.path.join(rundir, 'Makefile')])
+    for fname in os.listdir(rundir):
+        if fname.endswith(fortran_extensions):
+            fnames.add(os.path.join(rundir, fname))
+
+    with open(os.path.join(rundir, 'Makefile')) as f:
+        text = f.read()
+    for token in re.findall(r'\S*\$\([A-Za-z_][A-Za-z0-9_]*\)\S*', text):
+        path = _expand(token, makevars, env)
+        if not os.path.isabs(path):
+            path = os.path.join(rundir, path)
+        if os.path.isfile(path):
+            fnames.add(path)
+        elif os.path.isdir(path):
+            for ext in fortran_extensions + ('.amr_2d', '.amr_3d'):
+                fnames.update(glob.glob(os.path.join(path, '*' + ext)))
+            fnames.update(glob.glob(os.path.join(path, 'Makefile*')))
+
+    return sorted(fnames)
+
+
+def source_hash(rundir='.', env=None):
+    """
+    Hash of the sources and compiler settings the executable depends on.
+    """
+
+    if env is None:
+        env = os.environ
+    h = hashlib.sha256()
+    for name in ['CLAW', 'FC', 'FFLAGS', 'LFLAGS']:
+        h.update(('%s=%s\n' % (name, env.get(name, ''))).encode())
+    for fname in source_files(rundir, env):
+        h.update(os.path.relpath(fname, rundir).encode())
+        with open(fname, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def cached_executable(rundir='.', env=None, cache_dir=None, stdout=None,
+                      stderr=None):
+    """
+    Return the path to a cached executable for the code in rundir, building
+    it with `make new` and adding it to the cache if the sources or the
+    compiler flags have changed since it was last built.  make does not
+    track the flags, so the object files are always rebuilt rather than
+    relinked.  The cache directory defaults to rundir/.exe_cache.
+    """
+
+    if env is None:
+        env = os.environ
+    if cache_dir is None:
+        cache_dir = os.path.join(rundir, '.exe_cache')
+
+    exe_name = read_makefile_vars(rundir).get('EXE', 'xamr')
+    key = source_hash(rundir, env)[:16]
+    exe = os.path.join(cache_dir, key, exe_name)
+    if os.path.isfile(exe):
+        return os.path.abspath(exe)
+
+    print("Building %s, sources or flags have changed (hash %s)"
+          % (exe_name, key))
+    return_code = subprocess.call(['make', 'new'], cwd=rundir, env=env,
+                                  stdout=stdout, stderr=stderr)
+    if return_code != 0:
+        raise RuntimeError("make new failed in %s" % rundir)
+
+    if not os.path.isdir(os.path.dirname(exe)):
+        os.makedirs(os.path.dirname(exe))
+    tmpname = '%s.tmp%s' % (exe, os.getpid())
+    shutil.copy2(os.path.join(rundir, exe_name), tmpname)
+    os.replace(tmpname, exe)
+    return os.path.abspath(exe)
+
+
+def prepare_outdir(rundir='.', outdir='_output'):
+    """
+    Copy the data files from rundir to outdir, as runclaw.py does before
+    running the code there.
+    """
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    for fname in glob.glob(os.path.join(rundir, '*.data')):
+        shutil.copy(fname, outdir)
@@ -0,0 +1,176 @@
+"""
+Importable, asyncio based interface to the run-or-restart logic of
+run_with_restart.py, so that a notebook or a service can manage many runs
+without blocking.
+
+Each RunManager handles one case directory with its own environment (the
+global os.environ is never modified) and reports the same finished, latest
+and t_latest state that examine_outdir computes.  For example::
+
+    import asyncio
+    from run_manager import RunManager
+
+    async def main(case_dirs):
+        managers = [RunManager(d, num_threads=4) for d in case_dirs]
+        await asyncio.gather(*[m.launch() for m in managers])
+        while any(m.running for m in managers):
+            for m in managers:
+                print(m.rundir, await m.poll())
+            await asyncio.sleep(60)
+
+    asyncio.run(main(['test_advection_2d_square',
+                      'test_burgers_3d_cubedata']))
+
+This directory needs to be on sys.path to import run_manager.
+"""
+
+import os
+import time
+import signal
+import asyncio
+
+import run_with_restart
+
+
+class RunManager(object):
+    """
+    Launch, poll, cancel and restart the code in rundir asynchronously.
+
+    num_threads sets OMP_NUM_THREADS and env can give other environment
+    variables for this run only.  With direct=True the cached executable is
+    run directly rather than through `make output` (see exe_cache.py).
+    """
+
+    def __init__(self, rundir='.', num_threads=run_with_restart.num_threads_default,
+                 env=None, direct=False):
+        self.rundir = os.path.abspath(rundir)
+        self.outdir = os.path.join(self.rundir, run_with_restart.outdir)
+        self.env = run_with_restart.runtime_env(num_threads)
+        if env is not None:
+            self.env.update(env)
+        self.direct = direct
+        self.fname_output = os.path.join(self.rundir, 'run_output.txt')
+        self.fname_errors = os.path.join(self.rundir, 'run_errors.txt')
+        self.process = None
+        self.return_code = None
+        self._waiter = None
+        self._files = None
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.returncode is None
+
+    async def poll(self):
+        """
+        Return a dictionary with the state of the run: finished, latest and
+        t_latest as computed by examine_outdir, whether the code is running
+        and the return code of the last job launched by this manager.
+        """
+
+        loop = asyncio.get_event_loop()
+        finished, latest, t_latest = await loop.run_in_executor(
+                None, run_with_restart.examine_outdir, self.outdir)
+        return {'finished': finished, 'latest': latest, 't_latest': t_latest,
+                'running': self.running, 'return_code': self.return_code}
+
+    def _prepare(self, latest, t_latest):
+        """
+        Write the data files and open the output streams for a run from
+        scratch or a restart from fort.chk<latest> (blocking, so run in an
+        executor).  Returns (args, cwd) of the command to run.
+        """
+
+        restart = (latest is not None)
+        rundata = run_with_restart.prepare_rundata(self.rundir, latest)
+        rundata.write(out_dir=self.rundir)
+
+        access = 'a' if restart else 'w'
+        fout = open(self.fname_output, access)
+        ferr = open(self.fname_errors, access)
+        if restart:
+            fout.write("\n=========== RESTART =============\n" + \
+                    "Local time: %s\n" % time.strftime('%Y-%m-%d-%H%M%S') + \
+                    "Will attempt to restart using checkpoint file %s at t = %s\n" \
+                    % (latest, t_latest))
+            fout.flush()
+        self._files = (fout, ferr)
+
+        state = run_with_restart.load_restart_state(self.outdir)
+        state['attempts'].append({'start': time.time(), 'end': None,
+                                  'return_code': None, 'restart': restart,
+                                  't_start': (t_latest if restart
+                                              else rundata.clawdata.t0)})
+        run_with_restart.save_restart_state(self.outdir, state)
+
+        return run_with_restart.job_command(self.rundir, restart, self.env,
+                                            self.direct, fout, ferr)
+
+    async def launch(self):
+        """
+        Start the code from scratch, or restart it from the latest
+        checkpoint, unless it has already finished.  Returns the state as
+        given by poll() once the job has started.
+        """
+
+        if self.running:
+            raise RuntimeError("Code is already running in %s" % self.rundir)
+
+        state = await self.poll()
+        if state['finished']:
+            return state
+
+        loop = asyncio.get_event_loop()
+        args, cwd = await loop.run_in_executor(None, self._prepare,
+                                               state['latest'],
+                                               state['t_latest'])
+        fout, ferr = self._files
+        self.return_code = None
+        self.process = await asyncio.create_subprocess_exec(
+                *args, cwd=cwd, env=self.env, stdout=fout, stderr=ferr,
+                start_new_session=True)
+        self._waiter = asyncio.ensure_future(self._wait())
+        return await self.poll()
+
+    async def _wait(self):
+        self.return_code = await self.process.wait()
+        for f in self._files:
+            f.close()
+        state = run_with_restart.load_restart_state(self.outdir)
+        if len(state['attempts']) > 0:
+            state['attempts'][-1]['end'] = time.time()
+            state['attempts'][-1]['return_code'] = self.return_code
+            run_with_restart.save_restart_state(self.outdir, state)
+
+    async def wait(self):
+        """
+        Wait for the current job (if any) to finish and return the state.
+        """
+
+        if self._waiter is not None:
+            await asyncio.shield(self._waiter)
+        return await self.poll()
+
+    async def cancel(self, timeout=30.):
+        """
+        Terminate the running job, killing it if it has not exited after
+        timeout seconds, and return the state.
+        """
+
+        if self.running:
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+                await asyncio.wait_for(asyncio.shield(self._waiter), timeout)
+            except asyncio.TimeoutError:
+                os.killpg(self.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        return await self.wait()
+
+    async def restart(self):
+        """
+        Cancel the running job (if any) and restart the code from the
+        latest checkpoint.
+        """
+
+        await self.cancel()
+        return await self.launch()
@@ -14,11 +14,13 @@ Will do the following:
 
  - Check whether _output exists with data from a run that appeared to
    complete (by checking last line of fort.amr -- more robust way?).
+   Only the tail of fort.amr is read.
 
  - If so, it quits,
 
  - If _output exists with at least one checkpoint file, it will use the 
-   more recent one to restart the code.
+   more recent one to restart the code.  Checkpoints are tracked in
+   _output/checkpoint_manifest.json, see checkpoint_manifest.py.
 
  - If _output does not exist, it runs the code from scratch.
 
@@ -31,77 +33,333 @@ Notes:
  - The setrun.py file is used also for the restart.  The clawdata.restart
    value is set to True and written to claw.data explicitly from this script.
 
+Supervisor mode:
+
+    python run_with_restart.py --stall-time 600 --retries 5
+
+The job is killed if it makes no progress (see watchdog.py) for stall_time
+seconds, and then restarted from the newest valid checkpoint.  Failed or
+stalled runs are retried up to `--retries` times with exponential backoff,
+and every attempt is logged to run_output.txt.
+
+Adaptive checkpoint interval:
+
+    python run_with_restart.py --adaptive-interval
+
+On restart, the checkpoint interval is set from the measured checkpoint
+write time and the observed interruption rate, see checkpoint_interval.py.
+The attempts made and checkpoint write times are kept in
+_output/restart_state.json.
+
+Checkpoint retention:
+
+    python run_with_restart.py --keep-uncompressed 2 --keep-compressed 3
+
+While the code runs, older numbered checkpoints (checkpt_style 2 or 3) are
+compressed in a background thread and the oldest ones deleted, see
+checkpoint_retention.py.  A compressed checkpoint chosen for a restart is
+decompressed (and its checksum verified) first.
+
+Direct execution:
+
+    python run_with_restart.py --direct
+
+The executable is run directly in _output rather than through
+`make output`.  It is taken from a cache keyed by a hash of its sources and
+compiler flags, and rebuilt with `make .exe` only when that hash changes,
+see exe_cache.py.
+
+Telemetry:
+
+    python run_with_restart.py --telemetry 60
+
+The output streams are parsed incrementally while the code runs, a time
+series of the time steps is appended to _output/telemetry.csv and a progress
+report (simulated time per wall second, ETA, per-level steps) is printed
+every 60 seconds, see telemetry.py.
+
+See run_manager.py for an asyncio based RunManager class providing the same
+functionality to other Python code.
+
+Staging:
+
+    python run_with_restart.py --staging /local/scratch
+
+The code writes its output under the staging directory and a background
+thread copies it to _output, verifying the checksum of each checkpoint
+before making it visible there, see checkpoint_staging.py.  On restart, the
+newest complete checkpoint in either location is used.  With
+--keep-uncompressed, the retention policy is applied to both locations.
+
+Preemption:
+
+    python run_with_restart.py --grace 20
+
+On SIGTERM or SIGUSR1 (sent by batch schedulers before preempting a job or
+at its time limit), the preemption is recorded in the restart state and the
+file _output/checkpoint_request is written to ask the code for an immediate
+checkpoint.  The job is killed once a new checkpoint is complete or after
+the grace period, and no retry is made.  The code itself has to check for
+the request file, which stock AMRClaw does not do, so the grace period is 0
+by default and only the checkpoints already written are available.  Only
+give a grace period for code that checks for the request, and keep it well
+below the time the scheduler waits before killing the job (30 seconds by
+default for SLURM's KillWait).
+
+Campaign mode:
+
+    python run_with_restart.py test_advection_2d_square test_burgers_3d_cubedata
+
+Given one or more case directories, the run-or-restart logic above is applied
+to each of them, with up to `--jobs` cases running at once in a process pool.
+The cores of the machine (or `--cores` if given) are split evenly between the
+cases running concurrently by setting OMP_NUM_THREADS for each one, and a
+summary of the simulated time advanced per wall-clock second is printed for
+every case at the end.
+
 """
 
 from __future__ import print_function
 from __future__ import absolute_import
 
 import subprocess
-import os, sys
-sys.path.append('.')
-from setrun import setrun
+import os
+import time
+import signal
+
+import checkpoint_manifest
+import exe_cache
+import checkpoint_staging
+from watchdog import ProgressWatchdog
+from checkpoint_interval import CheckpointTimer, tune_checkpoint_interval
+from checkpoint_retention import CheckpointCompressor, restore_checkpoint
+from telemetry import RunTelemetry
 
 outdir = '_output'
 
-# set any desired environment flags:
+# default number of OpenMP threads when running a single case:
+num_threads_default = 3
+
+# file in outdir recording the attempts made to run the code:
+restart_state_name = 'restart_state.json'
+
+# signals sent by batch schedulers before a job is preempted or reaches its
+# time limit, on which a final checkpoint is requested:
+preempt_signals = [signal.SIGTERM, signal.SIGUSR1]
+
+# file written in outdir to request an immediate checkpoint.  The Fortran
+# code must check for it (e.g. once per level 1 time step), write a
+# checkpoint and stop when it appears:
+checkpoint_request_name = 'checkpoint_request'
+
+
+def runtime_env(num_threads=num_threads_default):
+    """
+    Return a copy of os.environ with the runtime flags for one case set,
+    so that cases running concurrently do not share (or clobber) settings.
+    """
+
+    # set any desired environment flags:
+
+    env = dict(os.environ)
+    #env['FFLAGS'] = '-O2 -fopenmp'  # currently assume code is already compiled.
 
-env = os.environ
-#env['FFLAGS'] = '-O2 -fopenmp'  # currently assume code is already compiled.
+    # runtime environment variables:
+    env['OMP_NUM_THREADS'] = str(num_threads)
 
-# runtime environment variables:
-env['OMP_NUM_THREADS'] = '3'
+    # The next line insures that stdout is not buffered so if the code dies
+    # the output sent to run_output.txt so the error message is visible:
+    env['GFORTRAN_UNBUFFERED_PRECONNECTED'] = 'y'  
 
-# The next line insures that stdout is not buffered so if the code dies
-# the output sent to run_output.txt so the error message is visible:
-env['GFORTRAN_UNBUFFERED_PRECONNECTED'] = 'y'  
+    return env
+
+
+def load_setrun(rundir='.'):
+    """
+    Import the setrun function from setrun.py in rundir.  The module is
+    loaded from its path rather than from sys.path so that several case
+    directories can be handled by the same process.
+    """
+
+    import importlib.util
+    fname = os.path.join(os.path.abspath(rundir), 'setrun.py')
+    spec = importlib.util.spec_from_file_location('setrun', fname)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.setrun
+
+
+def final_time(clawdata):
+    """
+    Final time of the run described by clawdata, for any output_style.
+    """
+
+    if clawdata.output_style == 2 and len(clawdata.output_times) > 0:
+        return clawdata.output_times[-1]
+    return clawdata.tfinal
 
 def examine_outdir(outdir='_output'):
     """
     Check the outdir to see if the code has already run to completion
     (in which case nothing is done) or needs to be restarted.
     If outdir does not exist, run from scratch.
+
+    The latest checkpoint is found from the checkpoint manifest (see
+    checkpoint_manifest.py), which is brought up to date with any
+    checkpoint files written since it was last updated.
     """
 
-    from numpy import Inf
-    fortamr = os.path.join(outdir,'fort.amr')
-    try:
-        f = open(fortamr).readlines()
-        finished = ('end of' in f[-1])  # examine last line for ending message
-    except:
-        finished = False
+    finished = checkpoint_manifest.run_finished(outdir)
 
-    try:
-        cfile = os.path.join(outdir,'fort.tckaaaaa')
-        f = open(cfile).readlines()
-        ta = float(f[0][29:])
-    except:
-        ta = -Inf
+    manifest = checkpoint_manifest.update_manifest(outdir)
+    latest, entry = checkpoint_manifest.latest_checkpoint(manifest)
 
-    try:
-        cfile = os.path.join(outdir,'fort.tckbbbbb')
-        f = open(cfile).readlines()
-        tb = float(f[0][29:])
-    except:
-        tb = -Inf
-
-    if (ta == -Inf) and (tb == -Inf):
-        print("Could not read fort.tckaaaaa or fort.tckbbbbb in outdir %s" \
+    if latest is None:
+        print("Could not find a complete checkpoint file in outdir %s" \
             % outdir)
-        latest = None
         t_latest = None
-    elif ta > tb:
-        latest = 'aaaaa'
-        t_latest = ta
     else:
-        latest = 'bbbbb'
-        t_latest = tb
+        t_latest = entry['time']
 
     return finished, latest, t_latest
 
 
-def run_code_or_restart():
+def load_restart_state(outdir='_output'):
+    """
+    Read the restart state from outdir: a dictionary with a list of the
+    'attempts' made to run the code (wall start and end times, return code)
+    and a list of the 'checkpoint_writes' timed while it was running.
+
+    An attempt with no end time was interrupted along with this script (e.g.
+    the machine went down), so its end is taken to be the last time anything
+    was written to outdir.
+    """
+
+    fname = os.path.join(outdir, restart_state_name)
+    state = checkpoint_manifest.read_json(fname, default={})
+    state.setdefault('attempts', [])
+    state.setdefault('checkpoint_writes', [])
+
+    for a in state['attempts']:
+        if a.get('end') is None:
+            mtimes = [a['start']]
+            for f in os.listdir(outdir):
+                if f == 'fort.amr' or f.startswith('fort.tck'):
+                    try:
+                        mtimes.append(os.path.getmtime(os.path.join(outdir, f)))
+                    except OSError:
+                        pass
+            a['end'] = max(mtimes)
+            a['return_code'] = None
+
+    return state
+
+
+def save_restart_state(outdir, state):
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+    checkpoint_manifest.write_json_atomic(
+            os.path.join(outdir, restart_state_name), state)
+
+
+def prepare_rundata(rundir='.', latest=None, work_outdir=None):
+    """
+    Return the rundata from setrun.py in rundir, set up to run from scratch
+    if latest is None or else to restart from checkpoint fort.chk<latest>
+    in work_outdir (default rundir/_output), which is decompressed first if
+    necessary.  The data files still need to be written with
+    rundata.write(out_dir=rundir).
+    """
+
+    if work_outdir is None:
+        work_outdir = os.path.join(rundir, outdir)
+    restart = (latest is not None)
+    if restart:
+        restore_checkpoint(work_outdir, latest)
+
+    setrun = load_setrun(rundir)
+    rundata = setrun('amrclaw')
+    rundata.clawdata.restart = restart
+    rundata.clawdata.restart_file = 'fort.chk' + str(latest)
+    if restart:
+        rundata.clawdata.output_t0 = False  # to avoid plotting at restart times
+    return rundata
+
+
+def job_command(rundir='.', restart=False, env=None, direct=False,
+                stdout=None, stderr=None, work_outdir=None):
+    """
+    Return (args, cwd) of the command that runs the code in rundir, writing
+    output to work_outdir (default rundir/_output): either `make output` in
+    rundir, or with direct=True the cached executable in work_outdir (see
+    exe_cache.py), building it first if necessary.
+    """
+
+    if direct:
+        # bypass make, runclaw.py does no more than this:
+        if work_outdir is None:
+            work_outdir = os.path.join(rundir, outdir)
+        args = [exe_cache.cached_executable(rundir, env, stdout=stdout,
+                                            stderr=stderr)]
+        exe_cache.prepare_outdir(rundir, work_outdir)
+        return args, work_outdir
+    args = ['make','output']
+    if restart:
+        args.append('RESTART=True')
+    if work_outdir is not None:
+        args.append('OUTDIR=%s' % work_outdir)
+    return args, rundir
+
+
+def run_code_or_restart(rundir='.', num_threads=num_threads_default,
+                        stall_time=None, poll_interval=1., attempt=1,
+                        adaptive_interval=False, keep_uncompressed=None,
+                        keep_compressed=3, direct=False,
+                        telemetry_interval=None, staging=None,
+                        preempt_grace=0.):
+    """
+    Run the code in rundir, or restart it from the latest checkpoint in
+    rundir/_output, unless a previous run has already finished.
+
+    If stall_time is given, the job is watched every poll_interval seconds
+    and killed if it makes no progress (see watchdog.py) for stall_time
+    seconds.  attempt > 1 indicates a retry by supervise_run, in which case
+    the output streams are appended to rather than overwritten.
+
+    If adaptive_interval is True, the checkpoint interval set in setrun.py is
+    replaced on restart by the one minimizing the expected lost work plus
+    checkpoint overhead, based on the checkpoint write times and
+    interruptions recorded in the restart state (see checkpoint_interval.py).
+
+    If keep_uncompressed is not None, a background thread compresses all but
+    the newest keep_uncompressed numbered checkpoints, keeping keep_compressed
+    compressed ones and deleting older ones (see checkpoint_retention.py).
+    A compressed checkpoint is decompressed before restarting from it.
+
+    If direct is True, the executable is run directly in outdir instead of
+    through `make output`, using a cached executable that is rebuilt only
+    when its sources or compiler flags change (see exe_cache.py).
+
+    If telemetry_interval is given, the output streams are parsed every
+    telemetry_interval seconds and a progress report printed (see
+    telemetry.py).
+
+    If staging is given, the code writes its output to a directory for this
+    case under staging (e.g. on node-local disk) and a background thread
+    copies it to _output, verifying the checksums of checkpoints (see
+    checkpoint_staging.py).  On restart the newest complete checkpoint in
+    either place is used.  The retention policy is then applied to both
+    directories by that thread.
+
+    If SIGTERM or SIGUSR1 is received while the code runs, an immediate
+    checkpoint is requested and the job killed once it is written or after
+    preempt_grace seconds (see request_checkpoint).  The default of 0 kills
+    it at once, as stock AMRClaw does not check for the request.
+
+    Returns a dictionary summarizing what was done, including the simulated
+    time advanced and the wall time it took (used by run_campaign).
+    """
 
-    import time
     tm = time.localtime()
     year = str(tm[0]).zfill(4)
     month = str(tm[1]).zfill(2)
@@ -111,16 +369,29 @@ def run_code_or_restart():
     second = str(tm[5]).zfill(2)
     timestamp = '%s-%s-%s-%s%s%s'  % (year,month,day,hour,minute,second)
 
-    finished, latest, t_latest = examine_outdir(outdir)
+    summary = {'rundir': rundir, 'return_code': None, 'restart': False,
+               'finished': False, 'stalled': False, 'preempted': False,
+               't_start': None, 't_end': None, 'wall_time': 0.}
+
+    rundir_outdir = os.path.join(rundir, outdir)
+    if staging is None:
+        work_outdir = rundir_outdir
+        finished, latest, t_latest = examine_outdir(rundir_outdir)
+    else:
+        work_outdir = checkpoint_staging.staging_outdir(staging, rundir)
+        finished, latest, t_latest = checkpoint_staging.select_checkpoint(
+                rundir_outdir, work_outdir)
 
     if finished:
-        print("Code has finished running, remove %s to run again" % outdir)
-        return
+        print("Code has finished running, remove %s to run again" \
+                % rundir_outdir)
+        summary['finished'] = True
+        return summary
 
     restart = (latest is not None)
 
-    fname_output = 'run_output.txt'
-    fname_errors = 'run_errors.txt'
+    fname_output = os.path.join(rundir, 'run_output.txt')
+    fname_errors = os.path.join(rundir, 'run_errors.txt')
 
     if restart:
         print("Will attempt to restart using checkpoint file %s at t = %s" \
@@ -130,11 +401,16 @@ def run_code_or_restart():
     else:
         print("Will run code -- no restart")
         print("Writing output stream to %s" % fname_output)
-        access = 'w'
+        access = 'w' if attempt == 1 else 'a'
 
     fout = open(fname_output, access)
     ferr = open(fname_errors, access)
 
+    if attempt > 1:
+        fout.write("\n=========== ATTEMPT %s =============\n" % attempt + \
+                "Local time: %s\n" % timestamp)
+        fout.flush()
+
     if restart:
         fout.flush()
         fout.write("\n=========== RESTART =============\n" + \
@@ -142,9 +418,6 @@ def run_code_or_restart():
                 "Will attempt to restart using checkpoint file %s at t = %s\n" \
                 % (latest, t_latest))
         fout.flush()
-        make_args = ['make','output','RESTART=True']
-    else:
-        make_args = ['make','output']
 
     #if restart:
     #    No longer need to do this since new restart now adds to gauge*.txt files
@@ -154,15 +427,141 @@ def run_code_or_restart():
     #    fout.write("Moving %s to %s \n" % (fortgauge,fortgauge2))
     #    fout.flush()
 
-    rundata = setrun('amrclaw')
-    rundata.clawdata.restart = restart
-    rundata.clawdata.restart_file = 'fort.chk' + str(latest)
-    if restart:
-        rundata.clawdata.output_t0 = False  # to avoid plotting at restart times
-    rundata.write()
-    
-    job = subprocess.Popen(make_args, stdout=fout,stderr=ferr,env=env)
-    return_code = job.wait()
+    rundata = prepare_rundata(rundir, latest, work_outdir)
+
+    state = load_restart_state(rundir_outdir)
+
+    if restart and adaptive_interval:
+        msg = tune_checkpoint_interval(rundata.clawdata, state, rundir_outdir,
+                                       t_latest, final_time(rundata.clawdata))
+        if msg is None:
+            msg = "Not enough information to tune the checkpoint interval"
+        print(msg)
+        fout.write(msg + "\n")
+        fout.flush()
+
+    rundata.write(out_dir=rundir)
+
+    summary['restart'] = restart
+    summary['t_start'] = t_latest if restart else rundata.clawdata.t0
+
+    env = runtime_env(num_threads)
+    job_args, job_cwd = job_command(rundir, restart, env, direct, fout, ferr,
+                                    None if staging is None else work_outdir)
+
+    state['attempts'].append({'start': time.time(), 'end': None,
+                              'return_code': None, 'restart': restart,
+                              't_start': summary['t_start']})
+    save_restart_state(rundir_outdir, state)
+
+    request_fname = os.path.join(work_outdir, checkpoint_request_name)
+    if os.path.exists(request_fname):
+        os.remove(request_fname)    # left over from an earlier preemption
+    signals_received = []
+    previous_handlers = trap_signals(
+            lambda signum, frame: signals_received.append(signum))
+
+    wall_start = time.time()
+    # start the job in its own process group so that the executable started
+    # by make can be killed along with make if the run hangs:
+    job = subprocess.Popen(job_args, stdout=fout, stderr=ferr, cwd=job_cwd,
+                           env=env, start_new_session=True)
+    try:
+        timer = CheckpointTimer(work_outdir)
+        if telemetry_interval is None:
+            telemetry = None
+        else:
+            telemetry = RunTelemetry(rundir, os.path.abspath(work_outdir),
+                                     tfinal=final_time(rundata.clawdata))
+            telemetry_time = time.time()
+        retention = None if keep_uncompressed is None \
+                    else (keep_uncompressed, keep_compressed)
+        if retention is None or staging is not None:
+            compressor = None   # the drainer applies it to both directories
+        else:
+            compressor = CheckpointCompressor(work_outdir, *retention,
+                                              log=print)
+            compressor.start()
+        if staging is None:
+            drainer = None
+        else:
+            drainer = checkpoint_staging.CheckpointDrain(work_outdir,
+                                                         rundir_outdir, log=print,
+                                                         retention=retention)
+            drainer.start()
+        if stall_time is None:
+            watchdog = None
+        else:
+            watchdog = ProgressWatchdog(work_outdir, fname_output, stall_time)
+        return_code = job.poll()
+        while return_code is None:
+            time.sleep(poll_interval)
+            timer.check()
+            if telemetry is not None \
+                    and time.time() - telemetry_time >= telemetry_interval:
+                telemetry.update()
+                print(telemetry.report())
+                telemetry_time = time.time()
+            if watchdog is not None:
+                watchdog.check()
+                if watchdog.stalled():
+                    msg = "No progress for %.0f seconds, killing job" \
+                            % watchdog.idle_time()
+                    print(msg)
+                    fout.write("\n=========== WATCHDOG =============\n" + \
+                            "Local time: %s\n" % time.strftime('%Y-%m-%d-%H%M%S') + \
+                            msg + "\n")
+                    fout.flush()
+                    kill_job(job)
+                    summary['stalled'] = True
+            if signals_received and not summary['preempted']:
+                signame = signal.Signals(signals_received[0]).name
+                msg = "Received %s, requesting a checkpoint" % signame
+                print(msg)
+                fout.write("\n=========== PREEMPTED =============\n" + \
+                        "Local time: %s\n" % time.strftime('%Y-%m-%d-%H%M%S') + \
+                        msg + "\n")
+                fout.flush()
+                summary['preempted'] = True
+                # recorded at once in case this process is killed first:
+                state['attempts'][-1]['preempted'] = {'signal': signame,
+                                                      'checkpoint': None,
+                                                      't_checkpoint': None}
+                save_restart_state(rundir_outdir, state)
+                latest, t_latest = request_checkpoint(job, work_outdir,
+                                                      preempt_grace)
+                if latest is None:
+                    msg = "No checkpoint written within %s seconds" % preempt_grace
+                else:
+                    msg = "Wrote checkpoint %s at t = %s" % (latest, t_latest)
+                print(msg)
+                fout.write(msg + "\n")
+                fout.flush()
+                state['attempts'][-1]['preempted'].update(
+                        checkpoint=latest, t_checkpoint=t_latest)
+            return_code = job.poll()
+    finally:
+        # e.g. on KeyboardInterrupt: the job is in its own session, so it
+        # would outlive this process unless it is killed here
+        restore_signals(previous_handlers)
+        if job.poll() is None:
+            kill_job(job)
+    timer.check()
+    if telemetry is not None:
+        telemetry.update()
+    if compressor is not None:
+        compressor.stop()
+    if drainer is not None:
+        drainer.stop()
+    summary['wall_time'] = time.time() - wall_start
+    summary['return_code'] = return_code
+
+    state['attempts'][-1]['end'] = time.time()
+    state['attempts'][-1]['return_code'] = return_code
+    for w in timer.writes:
+        w['attempt'] = len(state['attempts']) - 1
+    state['checkpoint_writes'] += timer.writes
+    save_restart_state(rundir_outdir, state)
     
     if return_code == 0:
         print("Successful run\n")
@@ -173,8 +572,248 @@ def run_code_or_restart():
     fout.close()
     ferr.close()
 
+    finished, latest, t_latest = examine_outdir(rundir_outdir)
+    summary['finished'] = finished
+    if finished:
+        summary['t_end'] = final_time(rundata.clawdata)
+    elif t_latest is not None:
+        summary['t_end'] = t_latest
+    else:
+        summary['t_end'] = summary['t_start']
+
+    return summary
+
+
+def kill_job(job, timeout=30.):
+    """
+    Terminate the process group of job (make and the executable it
+    started), killing it if it has not exited after timeout seconds.
+    """
+
+    try:
+        os.killpg(job.pid, signal.SIGTERM)
+        job.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        os.killpg(job.pid, signal.SIGKILL)
+        job.wait()
+    except ProcessLookupError:
+        pass
+
+
+def trap_signals(handler):
+    """
+    Install handler for the preempt_signals and return the previous
+    handlers.  Signals can only be trapped in the main thread, elsewhere
+    nothing is done.
+    """
+
+    previous = {}
+    try:
+        for signum in preempt_signals:
+            previous[signum] = signal.signal(signum, handler)
+    except ValueError:
+        pass
+    return previous
+
+
+def restore_signals(previous):
+    for signum, handler in previous.items():
+        signal.signal(signum, handler)
+
+
+def request_checkpoint(job, outdir='_output', grace=0., poll_interval=0.5):
+    """
+    Ask the running code for an immediate checkpoint by writing the file
+    checkpoint_request_name in outdir, then wait until a checkpoint newer
+    than those already there is complete, the job exits, or grace seconds
+    have passed, and kill the job.  Returns (suffix, time) of the new
+    checkpoint, or (None, None) if none was written.
+    """
+
+    manifest = checkpoint_manifest.update_manifest(outdir)
+    latest, entry = checkpoint_manifest.latest_checkpoint(manifest)
+    previous = None if entry is None else (latest, entry['tck_mtime'])
+
+    request_fname = os.path.join(outdir, checkpoint_request_name)
+    with open(request_fname, 'w') as f:
+        f.write("%s\n" % time.time())
+
+    def new_checkpoint():
+        manifest = checkpoint_manifest.update_manifest(outdir)
+        latest, entry = checkpoint_manifest.latest_checkpoint(manifest)
+        if entry is None or (latest, entry['tck_mtime']) == previous:
+            return None, None
+        return latest, entry['time']
+
+    deadline = time.time() + grace
+    latest, t_latest = None, None
+    while latest is None and job.poll() is None and time.time() < deadline:
+        time.sleep(poll_interval)
+        latest, t_latest = new_checkpoint()
+    kill_job(job, timeout=max(5., deadline - time.time()))
+    if latest is None:
+        latest, t_latest = new_checkpoint()
+
+    if os.path.exists(request_fname):
+        os.remove(request_fname)
+    return latest, t_latest
+
+
+def supervise_run(rundir='.', num_threads=num_threads_default,
+                  stall_time=None, max_retries=0, backoff=30., **kwargs):
+    """
+    Run or restart the code in rundir, retrying up to max_retries times
+    (restarting from the newest valid checkpoint each time) if the job fails
+    or is killed by the watchdog because it made no progress for stall_time
+    seconds.  The wait before retry number n is backoff * 2**(n-1) seconds.
+
+    Each attempt is logged to run_output.txt.  Returns the summary of the
+    last attempt, with the wall time and starting time of the whole sequence.
+    """
+
+    previous = None
+    for attempt in range(1, max_retries + 2):
+        summary = run_code_or_restart(rundir, num_threads=num_threads,
+                                      stall_time=stall_time, attempt=attempt,
+                                      **kwargs)
+        if previous is not None:
+            summary['wall_time'] += previous['wall_time']
+            if previous['t_start'] is not None:
+                summary['t_start'] = previous['t_start']
+        previous = summary
+        summary['attempts'] = attempt
+
+        if summary['finished'] or summary['preempted'] \
+                or summary['return_code'] in (None, 0):
+            break
+
+        if attempt <= max_retries:
+            wait = backoff * 2**(attempt - 1)
+            if summary['stalled']:
+                reason = "Run stalled"
+            else:
+                reason = "Run failed with return code %s" \
+                        % summary['return_code']
+            msg = "%s on attempt %s of %s, retrying in %s seconds" \
+                    % (reason, attempt, max_retries + 1, wait)
+            print(msg)
+            with open(os.path.join(rundir, 'run_output.txt'), 'a') as fout:
+                fout.write("\n%s\n" % msg)
+            time.sleep(wait)
+
+    return summary
+
+
+def _run_case(args):
+    """
+    Worker for run_campaign: run or restart one case in a pool process.
+    """
+
+    rundir, num_threads, options = args
+    print("Starting %s with OMP_NUM_THREADS = %s" % (rundir, num_threads))
+    return supervise_run(rundir, num_threads=num_threads, **options)
+
+
+def run_campaign(case_dirs, num_cores=None, max_concurrent=None, **options):
+    """
+    Run or restart each of the cases in case_dirs, running up to
+    max_concurrent of them at once in a process pool.
+
+    The num_cores cores (default: all cores of this machine) are split
+    evenly between the cases running concurrently.  Any other options are
+    passed to supervise_run for each case.  A throughput summary
+    (simulated time advanced per wall second) is printed for each case and
+    the list of summaries returned by run_code_or_restart is returned.
+    """
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    if num_cores is None:
+        num_cores = os.cpu_count() or 1
+    if max_concurrent is None:
+        max_concurrent = num_cores
+    max_concurrent = max(1, min(max_concurrent, len(case_dirs), num_cores))
+    num_threads = max(1, num_cores // max_concurrent)
+
+    print("Running %s cases, %s at a time with %s threads each" \
+            % (len(case_dirs), max_concurrent, num_threads))
+
+    with ProcessPoolExecutor(max_workers=max_concurrent) as pool:
+        summaries = list(pool.map(_run_case,
+                                  [(d, num_threads, options)
+                                   for d in case_dirs]))
+
+    print("\n%-40s %8s %12s %12s %12s" \
+            % ('case', 'status', 'sim time', 'wall (s)', 'sim/wall'))
+    for s in summaries:
+        if s['return_code'] is None:
+            status = 'done' if s['finished'] else 'skipped'
+        elif s['return_code'] == 0:
+            status = 'ok'
+        else:
+            status = 'error %s' % s['return_code']
+        if s['t_start'] is not None and s['t_end'] is not None:
+            advanced = s['t_end'] - s['t_start']
+        else:
+            advanced = 0.
+        if s['wall_time'] > 0:
+            rate = '%12.4e' % (advanced / s['wall_time'])
+        else:
+            rate = '%12s' % '-'
+        print("%-40s %8s %12.4e %12.2f %s" \
+                % (s['rundir'], status, advanced, s['wall_time'], rate))
+
+    return summaries
+
 
 if __name__ == "__main__":
 
-    run_code_or_restart()
-            
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Run or restart Clawpack cases from checkpoints.")
+    parser.add_argument('case_dirs', nargs='*',
+        help="case directories to run concurrently (default: current directory)")
+    parser.add_argument('--cores', type=int, default=None,
+        help="number of cores to split between cases (default: all)")
+    parser.add_argument('--jobs', type=int, default=None,
+        help="maximum number of cases to run at once")
+    parser.add_argument('--threads', type=int, default=num_threads_default,
+        help="OMP_NUM_THREADS when running a single case")
+    parser.add_argument('--stall-time', type=float, default=None,
+        help="kill and restart a run making no progress for this many seconds")
+    parser.add_argument('--retries', type=int, default=0,
+        help="number of times to restart a run that fails or stalls")
+    parser.add_argument('--backoff', type=float, default=30.,
+        help="seconds to wait before the first retry, doubled each time")
+    parser.add_argument('--adaptive-interval', action='store_true',
+        help="retune the checkpoint interval from measured costs on restart")
+    parser.add_argument('--keep-uncompressed', type=int, default=None,
+        help="compress all but this many of the newest numbered checkpoints")
+    parser.add_argument('--keep-compressed', type=int, default=3,
+        help="number of compressed checkpoints to keep before deleting")
+    parser.add_argument('--direct', action='store_true',
+        help="run a cached executable directly instead of make output")
+    parser.add_argument('--telemetry', type=float, default=None,
+        help="report progress from the output streams every this many seconds")
+    parser.add_argument('--staging', default=None,
+        help="write output under this (node-local) directory and copy it to _output")
+    parser.add_argument('--grace', type=float, default=0.,
+        help="seconds to wait for a checkpoint after SIGTERM or SIGUSR1, "
+             "only for code that checks for _output/checkpoint_request")
+    args = parser.parse_args()
+
+    options = dict(stall_time=args.stall_time, max_retries=args.retries,
+                   backoff=args.backoff,
+                   adaptive_interval=args.adaptive_interval,
+                   keep_uncompressed=args.keep_uncompressed,
+                   keep_compressed=args.keep_compressed,
+                   direct=args.direct,
+                   telemetry_interval=args.telemetry,
+                   staging=args.staging,
+                   preempt_grace=args.grace)
+
+    if len(args.case_dirs) == 0:
+        supervise_run('.', num_threads=args.threads, **options)
+    else:
+        run_campaign(args.case_dirs, num_cores=args.cores,
+                     max_concurrent=args.jobs, **options)
@@ -0,0 +1,216 @@
+"""
+Streaming telemetry for a run managed by run_with_restart.py.
+
+The output streams of a run are read incrementally (only what has been
+appended since the last update) and a compact time series is appended to
+_output/telemetry.csv, with one row per time step:
+
+    wall, level, cfl, dt, t
+
+where wall is the wall-clock time at which the step was seen.  Time steps
+are taken from the lines
+
+     AMRCLAW: level  1  CFL = .877E+00  dt = 0.1600E-01  final t = 0.160000E-01
+
+written to stdout (run_output.txt) for levels up to clawdata.verbosity, so
+verbosity must be at least 1 to get any.  Regridding messages, the lines
+
+    Regridding level   2 at t =  0.320000E+00:     4 grids with        1600 cells
+
+written to fort.amr for levels up to amrdata.verbosity_regrid, and the
+regridding time in the timing summary at the end of the run are read from
+fort.amr.
+
+The offsets reached in each stream are kept in _output/telemetry_state.json
+so that telemetry continues across restarts (a stream that has become
+shorter than the saved offset, e.g. because the run was started again from
+scratch, is read from the beginning).
+
+From the series, report() gives the simulated time advanced per wall-clock
+second, an estimate of the wall time remaining until tfinal, and per-level
+step counts and time steps, which can be used to spot a collapsing time step
+or runaway refinement while the run is in progress.
+
+Usage:
+
+    python telemetry.py [rundir [tfinal]]
+"""
+
+import os
+import re
+import time
+
+import checkpoint_manifest
+
+state_name = 'telemetry_state.json'
+csv_name = 'telemetry.csv'
+
+step_regexp = re.compile(r'AMRCLAW:\s+level\s+(\d+)\s+CFL\s*=\s*(\S+)'
+                         r'\s+dt\s*=\s*(\S+)\s+final t\s*=\s*(\S+)')
+regrid_regexp = re.compile(r'^\s*Regridding level\s+\d+\s+at t\s*=')
+regrid_time_regexp = re.compile(r'^\s*Regridding\s+([-+.\dEe]+)')
+
+
+def _float(s):
+    """
+    Convert a Fortran formatted number, which may lack the 'E', to float.
+    """
+
+    try:
+        return float(s)
+    except ValueError:
+        return float(re.sub(r'(\d)([-+]\d+)$', r'\1E\2', s))
+
+
+class RunTelemetry(object):
+    """
+    Incremental reader of the output streams of the run in rundir.
+    """
+
+    def __init__(self, rundir='.', outdir='_output', tfinal=None,
+                 fname_output='run_output.txt', window=50):
+        self.outdir = os.path.join(rundir, outdir)
+        self.streams = {'stdout': os.path.join(rundir, fname_output),
+                        'amr': os.path.join(self.outdir, 'fort.amr')}
+        self.tfinal = tfinal
+        self.window = window
+        state = checkpoint_manifest.read_json(
+                os.path.join(self.outdir, state_name), default={})
+        self.offsets = state.get('offsets', {})
+        self.levels = state.get('levels', {})
+        self.regrids = state.get('regrids', 0)
+        self.regrid_time = state.get('regrid_time', None)
+        self.last_t = state.get('last_t', None)
+        self.recent = [tuple(r) for r in state.get('recent', [])]
+
+    def _read_new_lines(self, name):
+        """
+        Return the complete lines appended to stream name since last read.
+        """
+
+        fname = self.streams[name]
+        try:
+            size = os.path.getsize(fname)
+        except OSError:
+            return []
+        offset = self.offsets.get(name, 0)
+        if size < offset:
+            offset = 0
+        with open(fname, 'rb') as f:
+            f.seek(offset)
+            text = f.read(size - offset)
+        end = text.rfind(b'\n') + 1    # leave any partial line for next time
+        self.offsets[name] = offset + end
+        return text[:end].decode('ascii', 'replace').splitlines()
+
+    def update(self):
+        """
+        Read what has been appended to the streams, append the new time
+        steps to telemetry.csv and save the offsets reached.  Returns the
+        number of time steps read.
+        """
+
+        if not os.path.isdir(self.outdir):
+            return 0
+
+        now = time.time()
+        rows = []
+        for line in self._read_new_lines('stdout'):
+            m = step_regexp.search(line)
+            if m is None:
+                continue
+            level = int(m.group(1))
+            cfl, dt, t = [_float(m.group(i)) for i in (2, 3, 4)]
+            rows.append((now, level, cfl, dt, t))
+
+            lev = self.levels.setdefault(str(level),
+                                         {'steps': 0, 'dt_min': dt})
+            lev['steps'] += 1
+            lev['dt'] = dt
+            lev['cfl'] = cfl
+            lev['dt_min'] = min(lev['dt_min'], dt)
+            if level == 1:
+                if self.last_t is not None and t < self.last_t:
+                    self.recent = []    # restarted from an earlier time
+                self.recent.append((now, t))
+                self.recent = self.recent[-self.window:]
+                self.last_t = t
+
+        for line in self._read_new_lines('amr'):
+            if regrid_regexp.match(line):
+                self.regrids += 1
+            m = regrid_time_regexp.match(line)
+            if m is not None:
+                self.regrid_time = _float(m.group(1))
+
+        csvfile = os.path.join(self.outdir, csv_name)
+        new_file = not os.path.exists(csvfile)
+        with open(csvfile, 'a') as f:
+            if new_file:
+                f.write('wall,level,cfl,dt,t\n')
+            for row in rows:
+                f.write('%.3f,%d,%.6e,%.6e,%.10e\n' % row)
+
+        checkpoint_manifest.write_json_atomic(
+                os.path.join(self.outdir, state_name),
+                {'offsets': self.offsets, 'levels': self.levels,
+                 'regrids': self.regrids, 'regrid_time': self.regrid_time,
+                 'last_t': self.last_t, 'recent': self.recent})
+        return len(rows)
+
+    def rate(self):
+        """
+        Simulated time advanced per wall second over the last window level 1
+        steps, or None if there are not enough of them.
+        """
+
+        if len(self.recent) < 2:
+            return None
+        (w0, t0), (w1, t1) = self.recent[0], self.recent[-1]
+        if w1 <= w0:
+            return None
+        return (t1 - t0) / (w1 - w0)
+
+    def eta(self):
+        """
+        Estimated wall seconds until tfinal, or None if unknown.
+        """
+
+        rate = self.rate()
+        if rate is None or rate <= 0 or self.tfinal is None \
+                or self.last_t is None:
+            return None
+        return max(0., self.tfinal - self.last_t) / rate
+
+    def report(self):
+        """
+        Return a short text report of the progress of the run.
+        """
+
+        lines = []
+        rate = self.rate()
+        eta = self.eta()
+        lines.append("t = %s, sim time per wall second = %s, ETA = %s" \
+                % ('%.6g' % self.last_t if self.last_t is not None else '-',
+                   '%.4g' % rate if rate is not None else '-',
+                   '%.0f s' % eta if eta is not None else '-'))
+        for level in sorted(self.levels, key=int):
+            lev = self.levels[level]
+            lines.append("  level %s: %s steps, dt = %.4g (min %.4g), CFL = %.3g" \
+                    % (level, lev['steps'], lev['dt'], lev['dt_min'],
+                       lev['cfl']))
+        regrid = "  regridding messages: %s" % self.regrids
+        if self.regrid_time is not None:
+            regrid += ", regridding wall time %.4g s" % self.regrid_time
+        lines.append(regrid)
+        return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+
+    import sys
+    rundir = sys.argv[1] if len(sys.argv) > 1 else '.'
+    tfinal = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    telemetry = RunTelemetry(rundir, tfinal=tfinal)
+    telemetry.update()
+    print(telemetry.report())
@@ -0,0 +1,41 @@
+"""
+Tests of optimal_interval against Daly's higher order estimate.
+"""
+
+import math
+
+import pytest
+
+from checkpoint_interval import optimal_interval
+
+
+def daly(cost, mtbf):
+    if cost >= 2. * mtbf:
+        return mtbf
+    return math.sqrt(2. * cost * mtbf) * (1. + math.sqrt(cost / (2. * mtbf)) / 3.
+                                          + cost / (9. * 2. * mtbf)) - cost
+
+
+@pytest.mark.parametrize('cost', [1., 60., 600., 3600.])
+def test_formula(cost):
+    mtbf = 3600.
+    assert optimal_interval(cost, mtbf) == pytest.approx(daly(cost, mtbf))
+
+
+def test_young_for_cheap_checkpoints():
+    cost, mtbf = 1., 86400.
+    assert optimal_interval(cost, mtbf) \
+            == pytest.approx(math.sqrt(2. * cost * mtbf), rel=1e-2)
+
+
+def test_cutoff():
+    mtbf = 3600.
+    # just below 2 M the estimate is 8/9 M, from 2 M on it is M
+    assert optimal_interval(2. * mtbf * (1. - 1e-9), mtbf) \
+            == pytest.approx(8. / 9. * mtbf)
+    assert optimal_interval(2. * mtbf, mtbf) == mtbf
+    assert optimal_interval(3. * mtbf, mtbf) == mtbf
+    # between M/2 and 2 M (where the first order formula stopped) the
+    # interval still grows with the cost
+    taus = [optimal_interval(cost, mtbf) for cost in [1800., 3600., 7000.]]
+    assert taus == sorted(taus) and taus[-1] < mtbf
@@ -0,0 +1,81 @@
+"""
+Watchdog used by run_with_restart.py to detect a run that has stopped making
+progress.
+
+Progress is any change in one of:
+
+ - the size of fort.amr in the output directory,
+ - the newest checkpoint time stamp file fort.tckXXXXX,
+ - the size of the file receiving stdout from the run (run_output.txt).
+
+If none of these change for more than stall_time seconds the run is
+considered to be hung.
+"""
+
+import os
+import glob
+import time
+
+
+def _file_size(fname):
+    try:
+        return os.path.getsize(fname)
+    except OSError:
+        return -1
+
+
+def _newest_mtime(pattern):
+    mtimes = []
+    for fname in glob.glob(pattern):
+        try:
+            mtimes.append(os.path.getmtime(fname))
+        except OSError:
+            pass
+    return max(mtimes) if mtimes else -1
+
+
+class ProgressWatchdog(object):
+    """
+    Keep track of the last time a run made progress.
+
+    Call check() periodically while the run is going; stalled() returns True
+    once no progress has been seen for more than stall_time seconds.
+    """
+
+    def __init__(self, outdir, fname_output, stall_time):
+        self.outdir = outdir
+        self.fname_output = fname_output
+        self.stall_time = stall_time
+        self.state = self.observe()
+        self.last_progress = time.time()
+
+    def observe(self):
+        """
+        Return a tuple that changes whenever the run makes progress.
+        """
+
+        return (_file_size(os.path.join(self.outdir, 'fort.amr')),
+                _newest_mtime(os.path.join(self.outdir, 'fort.tck*')),
+                _file_size(self.fname_output))
+
+    def check(self):
+        """
+        Look for progress since the last call, returning True if there was.
+        """
+
+        state = self.observe()
+        if state != self.state:
+            self.state = state
+            self.last_progress = time.time()
+            return True
+        return False
+
+    def idle_time(self):
+        """
+        Seconds since progress was last seen.
+        """
+
+        return time.time() - self.last_progress
+
+    def stalled(self):
+        return self.idle_time() > self.stall_time
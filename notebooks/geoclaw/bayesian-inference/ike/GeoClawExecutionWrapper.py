@@ -1,12 +1,20 @@
-from batch.batch import Job, BatchController
 import os
 import time
-import gzip
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from clawpack.clawutil.data import ClawRunData
 import clawpack.clawutil as clawutil
 from clawpack.geoclaw.surge.storm import Storm
 import setrun
 from get_hourly_gauge import Surge
+from sandbox import SandboxPool
+from evaluation_cache import EvaluationCache, fingerprint
+from storm_template import StormTemplate, prepare_atcf
+from fidelity import apply_fidelity
+from output_profile import gauge_only, read_gauge, GaugeTail
+from spinup_library import SpinupLibrary, not_repeated
 
 def days2seconds(days):
     return days * 60.0**2 * 24.0
@@ -38,52 +46,204 @@ class CustomStorm(Storm):
 
 class GeoClawExecutionWrapper(object):
 
-    def __init__(self):
+    def __init__(self, num_concurrent=1, num_threads=None, sandbox_root=None,
+                 executable='xgeoclaw', cache_dir='_eval_cache',
+                 cache_max_bytes=2 * 2**30, output_profile='gauge_only',
+                 spinup_dir='_spinup', spinup_max_bytes=20 * 2**30,
+                 spinup_every=1):
+        r"""
+        Each call to run() is made in its own sandbox (see sandbox.py), with
+        up to num_concurrent runs at once (through run_many or from several
+        threads) each using num_threads OpenMP threads (default: the
+        current OMP_NUM_THREADS divided between the concurrent runs).
+
+        Results are cached in cache_dir (see evaluation_cache.py), using at
+        most cache_max_bytes of disk; cache_dir=None disables the cache.
+
+        With output_profile='gauge_only' the runs write only the gauge and
+        field read by run(), in binary if supported (see output_profile.py);
+        'full' leaves the output set in setrun.py.
+
+        Runs checkpoint at every spinup_every-th storm track time and are
+        restarted from the checkpoints of earlier runs with the same storm up
+        to then, kept in spinup_dir (see spinup_library.py) using at most
+        spinup_max_bytes of disk; spinup_dir=None disables this.  The
+        checkpoints are hard linked into and out of the library, so the
+        sandboxes default to the directory containing spinup_dir (rather
+        than the system temporary directory), which is on the same
+        filesystem.
+        """
+        self.runtimes = 0
+        self._lock = threading.Lock()
+        self.num_concurrent = num_concurrent
+        self.output_profile = output_profile
+        if num_threads is None:
+            num_threads = max(1, int(os.environ.get('OMP_NUM_THREADS',
+                                                    os.cpu_count()))
+                                 // num_concurrent)
+        self.env = dict(os.environ)
+        self.env['OMP_NUM_THREADS'] = str(num_threads)
+        self.executable = os.path.abspath(executable)
+        if not os.path.exists(self.executable):
+            subprocess.check_call(['make', '.exe'])
+        if sandbox_root is None and spinup_dir is not None:
+            sandbox_root = os.path.dirname(os.path.abspath(spinup_dir))
+        self.sandboxes = SandboxPool(num_concurrent, root=sandbox_root)
+
         # get storm data, in order to create a storm object
         # Convert ATCF data to GeoClaw format
-        self.runtimes = 0
-        self.gauge_dir = os.path.join(os.getcwd(), '_output') 
-        if not os.path.exists(self.gauge_dir):
-            os.makedirs(self.gauge_dir)
         self.atcf_path = os.path.join(os.environ["CLAW"], "geoclaw", "scratch", "bal042005.dat")
+        prepare_atcf(self.atcf_path)
+        # parsed once; each run only substitutes the perturbed parameter
+        self.ike = CustomStorm(None, path=self.atcf_path, file_format="ATCF")
+        self.storm_template = StormTemplate(self.ike, self.ike.parameterName)
 
-        # Note that the get_remote_file function does not support gzip files which
-        # are not also tar files.  The following code handles this
-        with gzip.open(".".join((self.atcf_path, 'gz')), 'rb') as atcf_file:
-            with open(self.atcf_path, 'w') as atcf_unzipped_file:
-                atcf_unzipped_file.write(atcf_file.read().decode('ascii'))
-        self.storm_file = os.path.join(os.getcwd(), os.path.join(self.gauge_dir, 'new_ike.storm'))
-        self.ike = CustomStorm(self.storm_file, path=self.atcf_path, file_format="ATCF")
-
-    def run(self, parameter_name, parameter_value, start_time_in_seconds, end_time_in_seconds, gauge_id):
-        self.runtimes += 1
-        job = Job()
-        job.executable = 'xgeoclaw'
-        job.type = "storm-surge"
-        job.name = 'test'
-        job.prefix = 'ike'
-        job.rundata = setrun.setrun()
-        job.rundata = setrun.setgeo(job.rundata)
-        job.rundata.clawdata.t0 = start_time_in_seconds
-        job.rundata.clawdata.tfinal = end_time_in_seconds
-
-        # update parameter
-        self.ike = CustomStorm(self.storm_file, path=self.atcf_path, file_format="ATCF")
-        self.ike.updateParameter(parameter_value)
-
-        # write storm and run job to generate storm predictions
-        self.ike.write(path = self.storm_file, file_format='geoclaw')
-        
-        # execute job
-        job.rundata.surge_data.storm_file = self.storm_file
-        controller = BatchController(jobs = [job])
-        controller.wait = True
-        controller.verbose = False
-        controller.run()
-
-        # get gauge data from disk
-        surge = Surge(storm_path = self.storm_file, file_format='ATCF')     
-        return surge.read_gauges(output=self.gauge_dir, gauge_id = gauge_id, file_format='ATCF') 
+        # runtimes counts the GeoClaw runs actually made, not cache hits
+        self.fingerprint = fingerprint(setrun.__file__, self.atcf_path,
+                                       self.executable)
+        if cache_dir is None:
+            self.cache = None
+        else:
+            self.cache = EvaluationCache(cache_dir, cache_max_bytes)
+        if spinup_dir is None:
+            self.spinup = None
+        else:
+            self.spinup = SpinupLibrary(self.storm_template, spinup_dir,
+                                        spinup_max_bytes, spinup_every)
+
+    def run(self, parameter_name, parameter_value, start_time_in_seconds, end_time_in_seconds, gauge_id, fidelity=0):
+        r"""
+        Run the storm with parameter_name set to parameter_value (None for
+        the unperturbed storm) and return the gauge times and q[3] at
+        gauge_id.  fidelity > 0 gives a cheaper, coarser run (see
+        fidelity.py).
+        """
+        t, q, truncated = self.run_with_bound(parameter_name, parameter_value,
+                                              start_time_in_seconds,
+                                              end_time_in_seconds, gauge_id,
+                                              fidelity=fidelity)
+        return t, q
+
+    def run_with_bound(self, parameter_name, parameter_value, start_time_in_seconds, end_time_in_seconds, gauge_id, misfit=None, bound=None, fidelity=0, poll_interval=1.):
+        r"""
+        As run(), but if bound is given the gauge output is read while the
+        code runs (every poll_interval seconds) and misfit(t, q) summed over
+        the new records, with t the time since the first record.  Once the
+        sum exceeds bound the run is stopped.  Returns (t, q, truncated),
+        where truncated is True if the run was stopped and t, q are only the
+        records written by then.  Truncated runs are not cached.
+        """
+        extra = {'fidelity': fidelity} if fidelity else {}
+        if self.output_profile != 'full':
+            extra['output_profile'] = self.output_profile
+        if self.cache is not None:
+            key = self.cache.key(parameter_value, start_time_in_seconds,
+                                 end_time_in_seconds, gauge_id,
+                                 self.fingerprint, **extra)
+            result = self.cache.get(key)
+            if result is not None:
+                return result[0], result[1], False
+
+        with self._lock:
+            self.runtimes += 1
+        rundata = setrun.setrun()
+        rundata = setrun.setgeo(rundata)
+        rundata.clawdata.t0 = start_time_in_seconds
+        rundata.clawdata.tfinal = end_time_in_seconds
+        if fidelity:
+            apply_fidelity(rundata, fidelity)
+        if self.output_profile == 'gauge_only':
+            # eta (q[3] of the full output) is not a q field: GeoClaw writes
+            # it after the selected fields, so it is read as q[-1] below
+            gauge_only(rundata, [gauge_id], q_out_fields=[0])
+
+        restart = None
+        if self.spinup is not None:
+            spinup_key = self.spinup.key(self.fingerprint, gauge_id=gauge_id,
+                                         t0=start_time_in_seconds, **extra)
+            restart = self.spinup.find(parameter_value, spinup_key,
+                                       start_time_in_seconds)
+            t_restart = start_time_in_seconds if restart is None else restart['t']
+            rundata.clawdata.checkpt_style = 2
+            rundata.clawdata.checkpt_times = self.spinup.checkpoint_times(
+                t_restart, end_time_in_seconds)
+
+        with self.sandboxes.sandbox() as sandbox:
+            # write storm with the updated parameter and run job to
+            # generate storm predictions
+            self.storm_template.write(sandbox.storm_file, parameter_value)
+            rundata.surge_data.storm_file = sandbox.storm_file
+            if restart is not None:
+                rundata.clawdata.restart = True
+                rundata.clawdata.restart_file = self.spinup.restore(
+                    restart, sandbox.output, gauge_id)
+                rundata.clawdata.output_t0 = False
+
+            if bound is not None:
+                tail = GaugeTail(sandbox.output, gauge_id)
+                field = -1 if self.output_profile == 'gauge_only' else 3
+                chunks = []
+                partial = {'t_first': None, 'misfit': 0., 'num_read': 0}
+
+                def exceeds_bound():
+                    t, q = tail.read()
+                    keep = not_repeated(t, restart, partial['num_read'])
+                    partial['num_read'] += len(t)
+                    t, q = t[keep], q[:, keep]
+                    if len(t) > 0:
+                        if partial['t_first'] is None:
+                            partial['t_first'] = t[0]
+                        chunks.append((t, q[field]))
+                        partial['misfit'] += misfit(t - partial['t_first'], q[field])
+                    return partial['misfit'] > bound
+
+                truncated = sandbox.run(rundata, self.executable, env=self.env,
+                                        monitor=exceeds_bound,
+                                        poll_interval=poll_interval)
+                exceeds_bound()    # records written since the last poll
+                t = np.concatenate([c[0] for c in chunks] + [np.empty(0)])
+                q = np.concatenate([c[1] for c in chunks] + [np.empty(0)])
+            else:
+                truncated = False
+                sandbox.run(rundata, self.executable, env=self.env)
+
+                # get gauge data from disk
+                if self.output_profile == 'gauge_only':
+                    t, q = read_gauge(sandbox.output, gauge_id)
+                    q = q[-1]
+                else:
+                    surge = Surge()
+                    t, q = surge.read_gauges(output=sandbox.output, gauge_id=gauge_id, file_format='ATCF')
+                keep = not_repeated(t, restart)
+                t, q = t[keep], q[keep]
+
+            if self.spinup is not None:
+                self.spinup.add(parameter_value, spinup_key, sandbox.output,
+                                gauge_id, restart)
+
+        if truncated:
+            return t, q, True
+
+        if self.cache is not None:
+            self.cache.put(key, t, q)
+        return t, q, False
+
+    def run_many(self, parameter_name, parameter_values, start_time_in_seconds, end_time_in_seconds, gauge_id, fidelity=0):
+        r"""
+        Run every parameter vector in parameter_values, num_concurrent at a
+        time, and return the list of (t, q) gauge series in the same order.
+        """
+        with ThreadPoolExecutor(max_workers=self.num_concurrent) as executor:
+            futures = [executor.submit(self.run, parameter_name, values,
+                                       start_time_in_seconds,
+                                       end_time_in_seconds, gauge_id,
+                                       fidelity)
+                       for values in parameter_values]
+            return [f.result() for f in futures]
+
+    def close(self):
+        r"""Remove the sandboxes"""
+        self.sandboxes.close()
 
     def getStorm(self):
         return self.ike
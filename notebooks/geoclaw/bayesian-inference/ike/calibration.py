@@ -0,0 +1,105 @@
+r"""
+Pieces of the Ike max_wind_speed calibration shared by optimize_ike.py and
+the other calibration drivers: the reference data, the misfit of a model
+gauge series, and the chain statistics and plots written at the end.
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from GeoClawExecutionWrapper import days2seconds
+import observations
+
+parameter_name = 'max_wind_speed'
+theta0 = 40.
+theta_min = 0.
+theta_max = 70.
+
+# window and gauge of every forward run
+t0 = days2seconds(0)
+tfinal = days2seconds(10)
+gauge_id = 1
+
+start_timestamp = datetime.strptime('2008-09-13T07:00:00', '%Y-%m-%dT%H:%M:%S')
+
+
+def load_reference_data(filepath='CO-OPS_8771450_met.csv'):
+    r"""
+    Read the NOAA CO-OPS water levels at the gauge, with the surge y
+    (verified minus predicted) and the time_elapsed since start_timestamp
+    (see observations.py)
+    """
+    obs = observations.load_coops(filepath)
+    return pd.DataFrame({
+        'datetime': obs['datetime'],
+        'Verified (m)': obs['verified'],
+        'Predicted (m)': obs['predicted'],
+        'y': obs['residual'],
+        'time_elapsed': observations.elapsed_seconds(obs['datetime'],
+                                                     start_timestamp)})
+
+
+def interpolate_data(model_times, reference_times, ydata):
+    return np.interp(model_times, reference_times, ydata)
+
+
+def reference_series(model, ref_data):
+    r"""
+    Run the unperturbed storm and return its gauge times and the observed
+    surge interpolated to them, the data set the chain is fitted to
+    """
+    tmodel, ymodel = model.run(parameter_name, None, t0, tfinal, gauge_id)
+    ydata_new = interpolate_data(tmodel, ref_data['time_elapsed'].values.ravel(),
+                                 ref_data['y'].values.ravel())
+    return tmodel, ydata_new
+
+
+def sum_of_squares(tmodel, ymodel, xdata, ydata):
+    r"""
+    Sum of squared differences between the model gauge series (tmodel,
+    ymodel) and the data (xdata, ydata) interpolated to the model times
+    """
+    model_times = tmodel - tmodel.min()
+    ydata_new = interpolate_data(model_times, xdata, ydata)
+    length = min(ymodel.shape[0], ydata_new.shape[0])
+    res = ymodel.reshape(-1, 1)[:length] - ydata_new.reshape(-1, 1)[:length]
+    return (res**2).sum(axis=0)
+
+
+def residual_misfit(xdata, ydata):
+    r"""
+    Misfit of new records of a gauge series, for run_with_bound: the sum of
+    squared differences from the data interpolated to their times (relative
+    to the first record, as in sum_of_squares)
+    """
+    return lambda t, q: float(((q - interpolate_data(t, xdata, ydata))**2).sum())
+
+
+def parameter_names(dimension):
+    return ['%s_%f' % (parameter_name, float(t)) for t in range(dimension)]
+
+
+def save_chain_outputs(chain, names, results=None):
+    r"""
+    Write stats.txt and the chain, density and pairwise correlation panels
+    for chain (burn-in already removed), as optimize_ike.py does
+    """
+    from pymcmcstat.chain import ChainStatistics
+    from pymcmcstat import mcmcplot as mcp
+
+    stats = ChainStatistics.chainstats(chain, results, returnstats=True)
+    with open('stats.txt', 'w') as f:
+        f.write(str(stats))
+
+    settings = dict(
+        fig=dict(figsize=(7, 6))
+    )
+    f = mcp.plot_chain_panel(chain, names, settings)
+    f.savefig('chain_panel.png')
+    f = mcp.plot_density_panel(chain, names, settings)
+    f.savefig('density_panel.png')
+    f = mcp.plot_pairwise_correlation_panel(chain, names, settings)
+    f.savefig('correlation_panel.png')
+    return stats
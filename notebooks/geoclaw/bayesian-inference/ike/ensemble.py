@@ -0,0 +1,128 @@
+r"""
+Ensemble MCMC for expensive forward models, with the proposals of each step
+evaluated concurrently.
+
+The sampler is the affine-invariant ensemble sampler of Goodman and Weare
+(2010) with the stretch move, updating the walkers in two halves (Foreman-
+Mackey et al., 2013): every walker of one half proposes a move along the line
+through a random walker of the other half, so the proposals of a half do not
+depend on each other and their forward runs can all be made at once.  With K
+walkers each step is two batches of K / 2 concurrent runs.
+
+The posterior is the one sampled by pymcmcstat in optimize_ike.py: uniform
+priors within bounds, a likelihood exp(-ss / (2 sigma2)), and (with
+update_sigma) each walker's sigma2 drawn from its inverse gamma conditional
+after each step.
+"""
+
+import time
+
+import numpy as np
+
+
+class EnsembleSampler(object):
+
+    def __init__(self, sos_many, bounds, num_walkers, num_observations,
+                 sigma2=0.01**2, update_sigma=True, a=2., rng=None):
+        r"""
+        sos_many(thetas) returns the list of sums of squares of the forward
+        model at each parameter vector in thetas; num_observations is the
+        number of residuals summed (used for the sigma2 update).  a is the
+        scale of the stretch move.
+        """
+        self.sos_many = sos_many
+        self.bounds = np.asarray(bounds, dtype=float)
+        if num_walkers < 4 or num_walkers % 2:
+            raise ValueError("num_walkers must be even and at least 4")
+        self.num_walkers = num_walkers
+        self.num_observations = num_observations
+        self.S20 = sigma2
+        self.N0 = 1.
+        self.sigma2 = np.full(num_walkers, sigma2, dtype=float)
+        self.update_sigma = update_sigma
+        self.a = a
+        self.rng = np.random.default_rng(rng)
+        self.num_evaluations = 0
+
+    def _in_bounds(self, thetas):
+        return np.all((thetas >= self.bounds[:, 0]) &
+                      (thetas <= self.bounds[:, 1]), axis=1)
+
+    def _evaluate(self, thetas):
+        sss = np.array([float(ss) for ss in self.sos_many(list(thetas))])
+        self.num_evaluations += len(thetas)
+        return sss
+
+    def initial_ensemble(self, theta0, scale=0.05):
+        r"""
+        Walkers drawn uniformly within scale times the width of the bounds
+        around theta0, clipped to the bounds
+        """
+        theta0 = np.asarray(theta0, dtype=float)
+        width = self.bounds[:, 1] - self.bounds[:, 0]
+        thetas = theta0 + scale * width * \
+            self.rng.uniform(-1., 1., (self.num_walkers, len(theta0)))
+        return np.clip(thetas, self.bounds[:, 0], self.bounds[:, 1])
+
+    def run(self, thetas, nsteps, verbose=True):
+        r"""
+        Sample nsteps steps of the ensemble starting from the walkers thetas,
+        a (num_walkers, d) array, and return a results dictionary with the
+        chain, s2chain and sschain of all walkers, step by step (so that
+        nsimu = nsteps * num_walkers rows, as a pymcmcstat chain), the final
+        walkers and the acceptance rate.
+        """
+        thetas = np.array(thetas, dtype=float)
+        K, d = thetas.shape
+        half = K // 2
+        sss = self._evaluate(thetas)
+
+        chain = np.empty((nsteps, K, d))
+        s2chain = np.empty((nsteps, K))
+        sschain = np.empty((nsteps, K))
+        accepted = 0
+        start = time.time()
+
+        for i in range(nsteps):
+            for first in [0, half]:
+                active = np.arange(first, first + half)
+                others = np.setdiff1d(np.arange(K), active)
+                partners = thetas[self.rng.choice(others, half)]
+                # z ~ g(z) proportional to 1/sqrt(z) on [1/a, a]
+                z = ((self.a - 1.) * self.rng.random(half) + 1.)**2 / self.a
+                proposals = partners + z[:, None] * (thetas[active] - partners)
+
+                inside = self._in_bounds(proposals)
+                sss_new = np.full(half, np.inf)
+                if inside.any():
+                    sss_new[inside] = self._evaluate(proposals[inside])
+
+                log_alpha = (d - 1) * np.log(z) \
+                    - (sss_new - sss[active]) / (2 * self.sigma2[active])
+                accept = inside & (np.log(self.rng.random(half)) < log_alpha)
+                thetas[active[accept]] = proposals[accept]
+                sss[active[accept]] = sss_new[accept]
+                accepted += accept.sum()
+
+            if self.update_sigma:
+                shape = 0.5 * (self.N0 + self.num_observations)
+                scale = 0.5 * (self.N0 * self.S20 + sss)
+                self.sigma2 = scale / self.rng.gamma(shape, size=K)
+
+            chain[i] = thetas
+            s2chain[i] = self.sigma2
+            sschain[i] = sss
+
+            if verbose and (i + 1) % 10 == 0:
+                print('%d steps, acceptance rate %.2f, %d forward runs, %.0f s'
+                      % (i + 1, accepted / float((i + 1) * K),
+                         self.num_evaluations, time.time() - start))
+
+        return {'chain': chain.reshape((-1, d)),
+                's2chain': s2chain.reshape((-1, 1)),
+                'sschain': sschain.reshape((-1, 1)),
+                'nsimu': nsteps * K, 'nsteps': nsteps, 'num_walkers': K,
+                'accepted': accepted,
+                'acceptance_rate': accepted / float(nsteps * K),
+                'num_evaluations': self.num_evaluations,
+                'thetas': thetas}
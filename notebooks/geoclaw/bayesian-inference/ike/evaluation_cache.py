@@ -0,0 +1,117 @@
+r"""
+Content-addressed on-disk cache of GeoClaw forward-model evaluations.
+
+Each entry is a .npz file holding the gauge time series (t, q) of one run,
+named by a hash of everything the run depends on: the parameter vector, the
+time window, the gauge id and a fingerprint of the setrun configuration
+(see fingerprint()).  The same proposal evaluated again, e.g. by
+calculate_intervals after the MCMC run, is then read from disk instead of
+being run again.
+
+Entries are written atomically, so several processes can share a cache
+directory, and the least recently used ones are removed whenever the total
+size exceeds max_bytes.
+"""
+
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+
+def fingerprint(*paths):
+    r"""
+    Hash of the contents of the files in paths, e.g. setrun.py, the storm
+    track and the executable, to be included in every key.
+    """
+    h = hashlib.sha256()
+    for path in paths:
+        h.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                h.update(block)
+    return h.hexdigest()
+
+
+class EvaluationCache(object):
+
+    def __init__(self, path='_eval_cache', max_bytes=2 * 2**30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def key(self, parameter_value, t0, tfinal, gauge_id, fingerprint, **kwargs):
+        r"""
+        Key of the run with parameter vector parameter_value (None for the
+        unperturbed storm) over [t0, tfinal] read at gauge_id.  Any other
+        keyword arguments that change the result are hashed as well.
+        """
+        h = hashlib.sha256()
+        if parameter_value is None:
+            h.update(b'None')
+        else:
+            h.update(np.asarray(parameter_value, dtype=np.float64).tobytes())
+        h.update(json.dumps({'t0': float(t0), 'tfinal': float(tfinal),
+                             'gauge_id': int(gauge_id),
+                             'fingerprint': fingerprint,
+                             'extra': kwargs},
+                            sort_keys=True).encode())
+        return h.hexdigest()
+
+    def _fname(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key):
+        r"""Return (t, q) stored under key, or None"""
+        fname = self._fname(key)
+        try:
+            with np.load(fname) as data:
+                t, q = data['t'], data['q']
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(fname)    # mark as recently used
+        except OSError:
+            pass
+        self.hits += 1
+        return t, q
+
+    def put(self, key, t, q):
+        r"""Store (t, q) under key and evict old entries if needed"""
+        fd, tmpname = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, t=np.asarray(t), q=np.asarray(q))
+            os.replace(tmpname, self._fname(key))
+        except BaseException:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+            raise
+        self.evict()
+
+    def evict(self):
+        r"""Remove least recently used entries until under max_bytes"""
+        entries = []
+        for fname in os.listdir(self.path):
+            if not fname.endswith('.npz'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, fname))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, fname))
+        total = sum(size for mtime, size, fname in entries)
+        for mtime, size, fname in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, fname))
+            except OSError:
+                pass
+            total -= size
@@ -0,0 +1,148 @@
+r"""
+Lower fidelity versions of a GeoClaw storm surge run, and a correction
+from low to full fidelity gauge series.
+
+Fidelity 0 is the run as set up by setrun.py.  Higher fidelity levels
+coarsen the base grid and drop the finest AMR levels (see fidelity_levels),
+clipping the refinement regions to the levels that remain, which makes a run
+many times cheaper.
+
+A FidelityCorrection is fitted to pairs of runs of the same parameters at a
+low and at full fidelity: the full fidelity gauge series is modelled as
+a + b * (low fidelity series interpolated to the same times).  Once the
+fitted correction reproduces the full fidelity runs to within a tolerance,
+corrected low fidelity runs can stand in for full fidelity ones.
+MultiFidelityMisfit uses this to compute the misfit of a parameter vector
+from a cheap run, escalating to a full fidelity run only for promising
+parameter vectors (or while the correction is not yet good enough).  It can
+be the sos_function of a DelayedAcceptanceMCMC with early_abort, as in
+optimize_ike_surrogate.py: a proposal is then promising if its corrected
+misfit is below the bound under which it would be accepted.
+"""
+
+import numpy as np
+
+# (factor the base grid is coarsened by, number of AMR levels dropped)
+fidelity_levels = [(1, 0), (2, 1), (2, 2)]
+
+
+def apply_fidelity(rundata, fidelity):
+    r"""
+    Modify rundata in place for the given fidelity level and return it.
+    """
+    coarsen, drop_levels = fidelity_levels[fidelity]
+    clawdata = rundata.clawdata
+    amrdata = rundata.amrdata
+
+    clawdata.num_cells = [max(1, int(n) // coarsen) for n in clawdata.num_cells]
+
+    levels = max(1, amrdata.amr_levels_max - drop_levels)
+    amrdata.amr_levels_max = levels
+    for name in ['refinement_ratios_x', 'refinement_ratios_y',
+                 'refinement_ratios_t']:
+        ratios = getattr(amrdata, name, None)
+        if ratios is not None:
+            setattr(amrdata, name, list(ratios)[:max(levels - 1, 1)])
+
+    # regions are [minlevel, maxlevel, t1, t2, x1, x2, y1, y2]
+    regions = getattr(getattr(rundata, 'regiondata', None), 'regions', [])
+    for region in regions:
+        region[1] = min(region[1], levels)
+        region[0] = min(region[0], region[1])
+    # flagregions (Clawpack 5.7 and later) are FlagRegion objects
+    flagregions = getattr(getattr(rundata, 'flagregiondata', None),
+                          'flagregions', [])
+    for flagregion in flagregions:
+        flagregion.maxlevel = min(flagregion.maxlevel, levels)
+        flagregion.minlevel = min(flagregion.minlevel, flagregion.maxlevel)
+    # older topo files are [topotype, minlevel, maxlevel, t1, t2, fname]
+    topofiles = getattr(getattr(rundata, 'topo_data', None), 'topofiles', [])
+    for topofile in topofiles:
+        if len(topofile) == 6:
+            topofile[2] = min(topofile[2], levels)
+            topofile[1] = min(topofile[1], topofile[2])
+    return rundata
+
+
+class FidelityCorrection(object):
+
+    def __init__(self):
+        self.pairs = []
+        self.a = 0.
+        self.b = 1.
+        self.rms = None
+
+    def add_pair(self, t_low, q_low, t_full, q_full):
+        r"""Add the gauge series of one parameter vector at both fidelities"""
+        self.pairs.append((np.interp(t_full, t_low, q_low),
+                           np.asarray(q_full, dtype=float)))
+        self.fit()
+
+    def fit(self):
+        r"""
+        Least squares fit of a and b over all pairs, with rms the root mean
+        square error of the corrected series (None for fewer than 2 pairs)
+        """
+        if len(self.pairs) == 0:
+            return
+        x = np.concatenate([low for low, full in self.pairs])
+        y = np.concatenate([full for low, full in self.pairs])
+        A = np.vstack([np.ones_like(x), x]).T
+        (self.a, self.b), _, _, _ = np.linalg.lstsq(A, y, rcond=None)
+        if len(self.pairs) >= 2:
+            self.rms = float(np.sqrt(np.mean((self.a + self.b * x - y)**2)))
+
+    def correct(self, t, q):
+        return t, self.a + self.b * np.asarray(q, dtype=float)
+
+    def good_enough(self, tolerance):
+        return self.rms is not None and self.rms <= tolerance
+
+
+class MultiFidelityMisfit(object):
+
+    def __init__(self, model, sos, parameter_name, t0, tfinal, gauge_id,
+                 fidelity=1, tolerance=0.05, threshold=None):
+        r"""
+        Misfit of a parameter vector, computed as sos(t, q) of a run at the
+        given low fidelity, corrected.  A full fidelity run is made (and added
+        to the correction) instead if the correction is not yet within
+        tolerance (rms, in the units of q), or if the corrected misfit is below
+        threshold, i.e. the parameter vector is promising.  threshold can be
+        changed between calls, e.g. to track the current state of a chain.
+        """
+        self.model = model
+        self.sos = sos
+        self.args = (parameter_name, t0, tfinal, gauge_id)
+        self.fidelity = fidelity
+        self.tolerance = tolerance
+        self.threshold = threshold
+        self.correction = FidelityCorrection()
+        self.num_low = 0
+        self.num_full = 0
+
+    def _run(self, thetas, fidelity):
+        parameter_name, t0, tfinal, gauge_id = self.args
+        return self.model.run(parameter_name, thetas, t0, tfinal, gauge_id,
+                              fidelity=fidelity)
+
+    def __call__(self, thetas, bound=None):
+        r"""
+        Misfit of thetas.  If bound is given (by DelayedAcceptanceMCMC with
+        early_abort) it is used as the threshold, and (misfit, False) is
+        returned as no run is stopped early.
+        """
+        threshold = self.threshold if bound is None else bound
+        ss = None
+        t_low, q_low = self._run(thetas, self.fidelity)
+        self.num_low += 1
+        if self.correction.good_enough(self.tolerance):
+            ss = self.sos(*self.correction.correct(t_low, q_low))
+            if threshold is not None and ss <= threshold:
+                ss = None
+        if ss is None:
+            t_full, q_full = self._run(thetas, 0)
+            self.num_full += 1
+            self.correction.add_pair(t_low, q_low, t_full, q_full)
+            ss = self.sos(t_full, q_full)
+        return ss if bound is None else (ss, False)
@@ -64,20 +64,37 @@ class Surge():
         gauge = GaugeSolution(gauge_id = gauge_id, path=output)
         return gauge.t, gauge.q[3]
 	
-    def update_geosurge(self, output=None, file_format='geoclaw_surge'): 
-        
-        self.eye_location = np.zeros((self.storm_duration+1,2))
-        self.t = [self.storm.t[0] + i for i in range(self.storm_duration+1)]
-                    
-        # Convert the list of datetime objects to an array and 
-        # subtract the initial time from each datetime object 
-        # and convert the list to an array. Transform the array 
-        # to be in units of seconds.
+    @staticmethod
+    def timeline(t0, offsets):
+        r"""
+        Times offsets (in seconds) after t0, as a datetime64 array if t0 is
+        a datetime, or else as seconds
+        """
+        offsets = np.asarray(offsets)
+        if isinstance(t0, (datetime.datetime, np.datetime64)):
+            return np.datetime64(t0, 's') + offsets.astype('timedelta64[s]')
+        return t0 + offsets
+
+    def update_geosurge(self, output=None, file_format='geoclaw_surge',
+                        times=None): 
+        r"""
+        Interpolate the storm (forecasts every 6 hours) to times, in seconds
+        since the first forecast (default: every hour).  Only those times are
+        computed, and self.t is the matching datetime64 array, so nothing is
+        allocated per second of the storm.
+        """
         n_hours = (self.num_forecasts - 1) * 6 
         times_obs = np.linspace(0, self.num_forecasts-1, self.num_forecasts) * 6 * 3600 
-        times = np.array([3600 * i for i in range(0, n_hours+1)])
+        if times is None:
+            times = 3600 * np.arange(n_hours + 1)
+        times = np.asarray(times)
         print(times.shape)
 
+        self.eye_location = np.zeros((len(times), 2))
+        self.t = self.timeline(self.storm.t[0], times)
+        if getattr(self.storm, 'time_offset', None) is not None:
+            self.time_offset = self.storm.time_offset
+
         # Now interpolate data points given the times in seconds 
         p_obs = self.storm.central_pressure 
         mws_obs = self.storm.max_wind_speed
@@ -88,22 +105,21 @@ class Surge():
 
         print(mwr_obs.shape) 
             
-        lon = np.linspace(np.min(lon_obs), np.max(lon_obs), n_hours+1) 
-        
         # Create interpolation functions to linearly interpolate 
         # the observations 
         f_central_pressure = interp1d(times_obs, p_obs, kind='linear')
         f_max_wind_speed = interp1d(times_obs, mws_obs, kind='linear')
         f_max_wind_radius = interp1d(times_obs, mwr_obs, kind='linear')
-        f_lat = interp1d(lon_obs, lat_obs, kind='linear')
+        f_lon = interp1d(times_obs, lon_obs, kind='linear')
+        f_lat = interp1d(times_obs, lat_obs, kind='linear')
         f_storm_radius = interp1d(times_obs, storm_radius_obs, kind='linear')
 
         # Update the attributes with the interpolations 
         self.central_pressure = f_central_pressure(times)
         self.max_wind_speed = f_max_wind_speed(times)
         self.max_wind_radius = f_max_wind_radius(times)
-        self.eye_location[:, 0] = lon
-        self.eye_location[:, 1] = f_lat(lon)
+        self.eye_location[:, 0] = f_lon(times)
+        self.eye_location[:, 1] = f_lat(times)
         self.storm_radius = f_storm_radius(times)
 
         print(self.max_wind_speed.shape)
@@ -144,7 +160,8 @@ class Surge():
         #
         #plt.savefig('interpolation_graphs', file_format='pdf') 
 
-    def read_geosurge(self, path, file_format='geoclaw_surge', verbose=False):
+    def read_geosurge(self, path, file_format='geoclaw_surge', verbose=False,
+                      use_binary=True):
         r"""Read in a GeoClaw formatted storm file
 
         GeoClaw storm files are read in by the Fortran code and are not meant
@@ -153,6 +170,8 @@ class Surge():
         :Input:
          - *path* (string) Path to the file to be read.
          - *verbose* (bool) Output more info regarding reading.
+         - *use_binary* (bool) Memory-map the rows from path + '.npy' if
+           write_geosurge wrote it and it is not older than path.
         """
 
         with open(path, 'r') as data_file:
@@ -161,7 +180,12 @@ class Surge():
                                                       data_file.readline()[:19],
                                                       '%Y-%m-%dT%H:%M:%S')
 
-        data = np.loadtxt(path, skiprows=3)
+        binary_path = path + '.npy'
+        if use_binary and os.path.exists(binary_path) and \
+           os.path.getmtime(binary_path) >= os.path.getmtime(path):
+            data = np.load(binary_path, mmap_mode='r')
+        else:
+            data = np.loadtxt(path, skiprows=3, ndmin=2)
         num_forecasts = data.shape[0]
         self.eye_location = np.empty((num_forecasts, 2))
         assert(num_casts == num_forecasts)
@@ -182,7 +206,8 @@ class Surge():
         self.geo_storm_path = path         
     
     def write_geosurge(self, path, verbose=False, max_wind_radius_fill=None,
-                        storm_radius_fill=None, seconds_exist=False): 
+                        storm_radius_fill=None, seconds_exist=False,
+                        binary=False): 
         r"""
         Write out a geoclaw formated storm file with gauge heights attached 
         
@@ -205,92 +230,77 @@ class Surge():
            `storm` is the storm object.  Note that if this or `max_wind_radius`
            field remains -1 that this data line will be assumed to be redundant
            and not be written
-        """
+         - *binary* (bool) Also write the rows to path + '.npy', which
+           read_geosurge memory-maps instead of parsing the text file.
 
-        if max_wind_radius_fill is None:
-            max_wind_radius_fill = lambda t, storm: -1
-        if storm_radius_fill is None:
-            storm_radius_fill = lambda t, storm: -1
+        The rows are selected and filled with array masks, the fill functions
+        being called only for the rows that would otherwise be written with
+        a -1, and the file is formatted and written at once.
+        """
 
-        # Create list for output
-        # Leave this first line blank as we need to count the actual valid lines
-        # that will be left in the file below
-        num_casts = 0
-        data_string = [""]
         if self.time_offset is None:
             # Use the first time in sequence if not provided
             self.time_offset = self.t[0]
-        data_string.append("%s\n\n" % self.time_offset.isoformat())
-        print(len(self.t))
-        for n in range(len(self.t)):
-            # Remove duplicate times
-            if n > 0:
-                if self.t[n] == self.t[n - 1]:
-                    continue
-
-            num_columns = 7 + self.gauge.shape[1]
-            format_string = ("{:19,.8e} " * num_columns)[:-1] + "\n"
-            data = []
-
-            if seconds_exist:
-                data.append(self.t[n] - self.time_offset)
-            else:
-                data.append((self.t[n] - self.time_offset).total_seconds())
-
-            #data.append((self.t[n] - self.time_offset).total_seconds())
-            data.append(self.eye_location[n, 0])
-            data.append(self.eye_location[n, 1])
-
-            if self.max_wind_speed[n] == -1:
-                continue
-            data.append(self.max_wind_speed[n])
-
-            # Allow custom function to set max wind radius if not
-            # available
-            if self.max_wind_radius[n] == -1:
-                new_wind_radius = max_wind_radius_fill(self.t[n], self)
-                if new_wind_radius == -1:
-                    continue
-                else:
-                    data.append(new_wind_radius)
-            else:
-                data.append(self.max_wind_radius[n])
-
-            if self.central_pressure[n] == -1:
-                continue
-            data.append(self.central_pressure[n])
-
-            # Allow custom function to set storm radius if not available
-            if self.storm_radius[n] == -1:
-                new_storm_radius = storm_radius_fill(self.t[n], self)
-                if new_storm_radius == -1:
-                    continue
-                else:
-                    data.append(new_storm_radius)
-            else:
-                data.append(self.storm_radius[n])
-
-            num_gauges = self.gauge.shape[1]
-            for j in range(0, num_gauges): 
-                data.append(self.gauge[n, j])
-                
-            data_string.append(format_string.format(*data))
-            num_casts += 1
-
+        time_offset = self.time_offset
+        if isinstance(time_offset, np.datetime64):
+            time_offset = time_offset.astype('datetime64[us]').item()
+
+        if seconds_exist:
+            seconds = np.asarray(self.t, dtype=float) - self.time_offset
+        else:
+            seconds = (np.asarray(self.t, dtype='datetime64[us]')
+                       - np.datetime64(time_offset, 'us')) \
+                      / np.timedelta64(1, 's')
+
+        max_wind_speed = np.asarray(self.max_wind_speed, dtype=float)
+        max_wind_radius = np.array(self.max_wind_radius, dtype=float)
+        central_pressure = np.asarray(self.central_pressure, dtype=float)
+        storm_radius = np.array(self.storm_radius, dtype=float)
+
+        # Remove duplicate times and rows with missing data
+        keep = np.ones(len(seconds), dtype=bool)
+        keep[1:] = seconds[1:] != seconds[:-1]
+        keep &= (max_wind_speed != -1) & (central_pressure != -1)
+
+        # Allow custom functions to set max wind radius and storm radius if
+        # not available
+        for values, fill in [(max_wind_radius, max_wind_radius_fill),
+                             (storm_radius, storm_radius_fill)]:
+            missing = keep & (values == -1)
+            if fill is not None:
+                for n in np.nonzero(missing)[0]:
+                    values[n] = fill(self.t[n], self)
+            keep &= values != -1
+
+        columns = [seconds, self.eye_location[:, 0], self.eye_location[:, 1],
+                   max_wind_speed, max_wind_radius, central_pressure,
+                   storm_radius]
+        data = np.column_stack(columns)
+        if self.gauge is not None:
+            data = np.hstack([data, np.asarray(self.gauge, dtype=float)
+                                      .reshape((len(seconds), -1))])
+        data = data[keep]
+        if verbose:
+            print("Writing %s of %s forecasts" % (data.shape[0], len(seconds)))
+
+        row_format = ' '.join(['%19.8e'] * data.shape[1]) + '\n'
+        contents = "%s\n" % data.shape[0] \
+                   + "%s\n\n" % time_offset.isoformat() \
+                   + (row_format * data.shape[0]) % tuple(data.ravel())
 
         # Write to actual file now that we know exactly how many lines it will
         # contain
         try:
-            # Update number of forecasts here
-            data_string[0] = "%s\n" % num_casts
             with open(path, "w") as data_file:
-                for data_line in data_string:
-                    data_file.write(data_line)
+                data_file.write(contents)
+            if binary:
+                np.save(path + '.npy', data)
 
         except Exception as e:
             # Remove possibly partially generated file if not successful
-            if os.path.exists(path):
-                os.remove(path)
+            for fname in [path, path + '.npy']:
+                if os.path.exists(fname):
+                    os.remove(fname)
             raise e
 
         
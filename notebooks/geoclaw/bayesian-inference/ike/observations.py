@@ -0,0 +1,80 @@
+r"""
+Loader of NOAA CO-OPS water level observations.
+
+A CO-OPS CSV has one row per observation time, with columns Date
+(YYYY/MM/DD), Time (LST) (HH:MM), Predicted (m) and Verified (m), the
+missing verified levels being written as '-'.  load_coops() returns the
+observation times and the verified, predicted and residual (verified minus
+predicted, the surge) levels as numpy arrays, parsing the whole file at once
+rather than row by row.
+
+The parsed arrays are cached in cache_dir as a .npz file named by the hash
+of the CSV contents, so a file is only parsed the first time it is loaded
+(and again if it changes).
+"""
+
+import os
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+# changing the parsing must change this, to invalidate cached files
+cache_version = 1
+
+date_column = 'Date'
+time_column = 'Time (LST)'
+predicted_column = 'Predicted (m)'
+verified_column = 'Verified (m)'
+
+
+def file_hash(filepath):
+    h = hashlib.sha256(b'%d' % cache_version)
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def parse_coops(filepath):
+    r"""
+    Parse the CO-OPS CSV filepath, dropping rows without a verified or
+    predicted level, and return a dictionary of arrays datetime
+    (datetime64[s]), verified, predicted and residual
+    """
+    df = pd.read_csv(filepath, na_values=['-'], skipinitialspace=True)
+    datetimes = pd.to_datetime(df[date_column] + ' ' + df[time_column],
+                               format='%Y/%m/%d %H:%M')
+    verified = pd.to_numeric(df[verified_column], errors='coerce').values
+    predicted = pd.to_numeric(df[predicted_column], errors='coerce').values
+    valid = ~(np.isnan(verified) | np.isnan(predicted))
+    return {'datetime': datetimes.values[valid].astype('datetime64[s]'),
+            'verified': verified[valid],
+            'predicted': predicted[valid],
+            'residual': verified[valid] - predicted[valid]}
+
+
+def load_coops(filepath, cache_dir='_obs_cache'):
+    r"""
+    As parse_coops(filepath), read from cache_dir if the file has been
+    parsed before; cache_dir=None disables the cache.
+    """
+    if cache_dir is None:
+        return parse_coops(filepath)
+    cache_path = os.path.join(cache_dir, file_hash(filepath) + '.npz')
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            return {name: data[name] for name in data.files}
+
+    obs = parse_coops(filepath)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = '%s.tmp%s.npz' % (cache_path[:-len('.npz')], os.getpid())
+    np.savez(tmp_path, **obs)
+    os.replace(tmp_path, cache_path)
+    return obs
+
+
+def elapsed_seconds(datetimes, start):
+    r"""Seconds from the datetime start to each of datetimes"""
+    return (datetimes - np.datetime64(start, 's')) / np.timedelta64(1, 's')
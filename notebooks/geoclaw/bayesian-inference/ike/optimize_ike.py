@@ -7,12 +7,12 @@
 #SBATCH --nodes=1
 #SBATCH --time=96:00:00             # The time the job will take to run.
 
-import pandas as pd
 import joblib
 import dill
-import os, sys
-from datetime import datetime, timedelta
-from GeoClawExecutionWrapper import GeoClawExecutionWrapper, days2seconds, seconds2days
+import os, sys, time
+from GeoClawExecutionWrapper import GeoClawExecutionWrapper
+import calibration
+from trace_store import TraceStore
 import logging
 import numpy as np
 import scipy
@@ -28,14 +28,13 @@ os.environ['OMP_STACKSIZE'] = '16M'
 # In[2]:
 
 model = GeoClawExecutionWrapper()
-model.parameter_name = 'max_wind_speed'
+model.parameter_name = calibration.parameter_name
+# every evaluation made by geoss, see trace_store.py
+traces = TraceStore('_traces')
 
 
 def geofun(time, thetas, y0, xdata):
-    return model.run(model.parameter_name, thetas, days2seconds(0), days2seconds(10), 1)
-
-def interpolate_data(model_times, reference_times, ydata):
-    return np.interp(model_times, reference_times, ydata)
+    return model.run(model.parameter_name, thetas, calibration.t0, calibration.tfinal, calibration.gauge_id)
 
 def geoss(thetas, data):
     print ('shapes:', data.ydata[0].shape, len(data.ydata), len(data.ydata))
@@ -43,37 +42,21 @@ def geoss(thetas, data):
     ydata = data.ydata[0][:, 0]
     xdata = data.xdata[0][:, 0]
     assert len(ydata) > 0, "ydata is empty!"
+    start = time.time()
     tmodel, ymodel = geofun(None, thetas, ydata[0], [])
-    with open('tmodel.npy', 'w') as f:
-        f.write(str(tmodel.tolist()))
-    with open('ymodel.npy', 'w') as f:
-        f.write(str(ymodel.tolist()))
-    model_times = tmodel - tmodel.min()
+    wall_time = time.time() - start
     print (ydata.shape, xdata.shape)
-    ydata_new = interpolate_data(model_times, xdata, ydata) 
-    length = min(ymodel.shape[0], ydata_new.shape[0])
-    res = ymodel.reshape(-1, 1)[:length] - ydata_new.reshape(-1, 1)[:length]
-    return (res**2).sum(axis=0)
+    ss = calibration.sum_of_squares(tmodel, ymodel, xdata, ydata)
+    traces.append(thetas, ss[0], wall_time, tmodel, ymodel)
+    return ss
 
 
 
 filepath = 'CO-OPS_8771450_met.csv'
-ref_data = pd.read_csv(filepath)
-ref_data["datetime"] = ref_data.apply(lambda x: datetime.strptime(x['Date'] + ' ' + x["Time (LST)"], '%Y/%m/%d %H:%M'), axis = 1)
-max_value = ref_data['Verified (m)'].max()
-ref_data['Verified (m)'] = ref_data['Verified (m)'].replace('-', np.nan)
-ref_data['Verified (m)'] = ref_data['Verified (m)'].astype(float)
-ref_data.dropna(subset=['Verified (m)'], inplace = True)
-ref_data["y"] = ref_data['Verified (m)'].values - ref_data['Predicted (m)'].values
-
-start_timestamp = datetime.strptime('2008-09-13T07:00:00', '%Y-%m-%dT%H:%M:%S')
-time_offset = lambda dt: (dt - start_timestamp).total_seconds()
-ref_data['time_elapsed'] = ref_data['datetime'].apply(time_offset).values
+ref_data = calibration.load_reference_data(filepath)
 
 # In[10]:
-tmodel, ymodel = geofun(None, None, None, [])
-model_times = tmodel
-ydata_new = interpolate_data(model_times, ref_data['time_elapsed'].values.ravel(), ref_data['y'].values.ravel())
+model_times, ydata_new = calibration.reference_series(model, ref_data)
 
 with open('ydata_new.npy', 'w') as f:
     f.write(str(ydata_new.tolist()))
@@ -93,7 +76,7 @@ mcstat.data.add_data_set(x = model_times,
 # add model parameters
 dimension = model.getStorm().getParameterDimension()
 for t in range(dimension[0]):
-    mcstat.parameters.add_model_parameter(name='max_wind_speed_%f' % float(t), theta0=40, minimum=0, maximum = 70)
+    mcstat.parameters.add_model_parameter(name='max_wind_speed_%f' % float(t), theta0=calibration.theta0, minimum=calibration.theta_min, maximum = calibration.theta_max)
 
 # Generate options
 mcstat.simulation_options.define_simulation_options(
@@ -133,27 +116,8 @@ chain = results['chain'][burnin:, :]
 s2chain = results['s2chain'][burnin:, :]
 names = results['names'] # parameter names
 
-# dump chainstats
-stats = mcstat.chainstats(chain, results, returnstats = True)
-with open ('stats.txt', 'w') as f:
-    f.write(str(stats))
-
-from pymcmcstat import mcmcplot as mcp
-settings = dict(
-    fig=dict(figsize=(7, 6))
-)
-
-# plot chain panel
-f = mcp.plot_chain_panel(chain, names, settings)
-f.savefig('chain_panel.png')
-
-# plot density panel
-f = mcp.plot_density_panel(chain, names, settings)
-f.savefig('density_panel.png')
-
-# pairwise correlation
-f = mcp.plot_pairwise_correlation_panel(chain, names, settings)
-f.savefig('correlation_panel.png')
+# dump chainstats and plot chain, density and pairwise correlation panels
+calibration.save_chain_outputs(chain, names, results)
 
 # dump results object
 with open('results.dill', 'wb') as f:
@@ -201,4 +165,5 @@ f = mcp.plot_pairwise_correlation_panel(chain, names, settings)
 # In[ ]:
 
 
+model.close()
 print ('done')
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#SBATCH --account=apam           # The account name for the job.
+#SBATCH --exclusive
+#SBATCH --job-name=GeoClawIkeEns  # The job name.
+#SBATCH --nodes=1
+#SBATCH --time=96:00:00             # The time the job will take to run.
+
+# Calibration of the Ike max_wind_speed values as in optimize_ike.py, with
+# an ensemble of walkers (stretch move, see ensemble.py) in place of the
+# single adaptive Metropolis chain.  Each step runs the proposals of half of
+# the walkers at once, with the 24 cores split between them.
+
+import os
+import dill
+import numpy as np
+from GeoClawExecutionWrapper import GeoClawExecutionWrapper
+import calibration
+from ensemble import EnsembleSampler
+np.seterr(over='ignore');
+SEED = 117
+
+os.environ['OMP_NUM_THREADS'] = '24'
+os.environ['OMP_STACKSIZE'] = '16M'
+
+num_walkers = 16
+nsteps = 125            # nsteps * num_walkers chain rows, as nsimu=1e3 in optimize_ike.py
+# the proposals of num_walkers / 2 walkers are run at once, 3 threads each
+model = GeoClawExecutionWrapper(num_concurrent=num_walkers // 2)
+
+ref_data = calibration.load_reference_data('CO-OPS_8771450_met.csv')
+model_times, ydata_new = calibration.reference_series(model, ref_data)
+
+def sos_many(thetas):
+    results = model.run_many(calibration.parameter_name, thetas,
+                             calibration.t0, calibration.tfinal,
+                             calibration.gauge_id)
+    return [calibration.sum_of_squares(tmodel, ymodel, model_times, ydata_new)[0]
+            for tmodel, ymodel in results]
+
+dimension = model.getStorm().getParameterDimension()[0]
+bounds = [(calibration.theta_min, calibration.theta_max)] * dimension
+sampler = EnsembleSampler(sos_many, bounds, num_walkers,
+                          num_observations=len(ydata_new),
+                          sigma2=0.01**2, update_sigma=True, rng=SEED)
+
+print ('running simulation ...')
+walkers = sampler.initial_ensemble(dimension * [calibration.theta0])
+results = sampler.run(walkers, nsteps)
+results['names'] = calibration.parameter_names(dimension)
+print ('%d forward runs for %d steps of %d walkers, acceptance rate %.2f'
+       % (results['num_evaluations'], nsteps, num_walkers,
+          results['acceptance_rate']))
+
+# dump run times
+with open ('runtimes.txt', 'w') as f:
+    f.write(str(model.runtimes))
+
+# the chain is step by step, so this drops the first half of the steps
+burnin = int(results['nsimu']/2)
+chain = results['chain'][burnin:, :]
+calibration.save_chain_outputs(chain, results['names'], results)
+
+with open('results.dill', 'wb') as f:
+    dill.dump(results, f)
+
+model.close()
+print ('done')
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+#SBATCH --account=apam           # The account name for the job.
+#SBATCH --exclusive
+#SBATCH --job-name=GeoClawIkeDA  # The job name.
+#SBATCH --nodes=1
+#SBATCH --time=24:00:00             # The time the job will take to run.
+
+# Calibration of the Ike max_wind_speed values as in optimize_ike.py, with
+# a Gaussian-process surrogate screening the proposals (delayed acceptance,
+# see surrogate.py) so that only those it accepts are run with GeoClaw.
+# With low_fidelity set, those are run at that fidelity level and corrected,
+# with full fidelity runs only while the correction is fitted and for
+# proposals that could be accepted (see MultiFidelityMisfit in fidelity.py).
+
+import os
+import dill
+import numpy as np
+from GeoClawExecutionWrapper import GeoClawExecutionWrapper
+import calibration
+from surrogate import DelayedAcceptanceMCMC
+from fidelity import MultiFidelityMisfit
+np.seterr(over='ignore');
+SEED = 117
+
+os.environ['OMP_NUM_THREADS'] = '24'
+os.environ['OMP_STACKSIZE'] = '16M'
+
+nsimu = 1000
+num_design = 40         # forward runs in the initial design
+num_concurrent = 4      # design runs made at once
+early_abort = True      # stop runs that can no longer be accepted
+low_fidelity = None     # e.g. 1 to screen the proposals at fidelity 1
+
+model = GeoClawExecutionWrapper(num_concurrent=num_concurrent)
+
+ref_data = calibration.load_reference_data('CO-OPS_8771450_met.csv')
+model_times, ydata_new = calibration.reference_series(model, ref_data)
+
+misfit = calibration.residual_misfit(model_times, ydata_new)
+
+def sos(thetas, bound=None):
+    if bound is None:
+        tmodel, ymodel = model.run(calibration.parameter_name, thetas,
+                                   calibration.t0, calibration.tfinal,
+                                   calibration.gauge_id)
+        return calibration.sum_of_squares(tmodel, ymodel, model_times, ydata_new)[0]
+    tmodel, ymodel, truncated = model.run_with_bound(
+        calibration.parameter_name, thetas, calibration.t0, calibration.tfinal,
+        calibration.gauge_id, misfit, bound)
+    if truncated:
+        return bound, True
+    return calibration.sum_of_squares(tmodel, ymodel, model_times, ydata_new)[0], False
+
+if low_fidelity is not None:
+    sos = MultiFidelityMisfit(
+        model, lambda t, q: calibration.sum_of_squares(t, q, model_times, ydata_new)[0],
+        calibration.parameter_name, calibration.t0, calibration.tfinal,
+        calibration.gauge_id, fidelity=low_fidelity)
+
+def sos_many(thetas):
+    results = model.run_many(calibration.parameter_name, thetas,
+                             calibration.t0, calibration.tfinal,
+                             calibration.gauge_id)
+    return [calibration.sum_of_squares(tmodel, ymodel, model_times, ydata_new)[0]
+            for tmodel, ymodel in results]
+
+dimension = model.getStorm().getParameterDimension()[0]
+bounds = [(calibration.theta_min, calibration.theta_max)] * dimension
+sampler = DelayedAcceptanceMCMC(sos, bounds, num_observations=len(ydata_new),
+                                sigma2=0.01**2, update_sigma=True,
+                                early_abort=early_abort, rng=SEED)
+
+print ('running initial design ...')
+sampler.initial_design(num_design, evaluate_many=sos_many)
+
+print ('running simulation ...')
+results = sampler.run(dimension * [calibration.theta0], nsimu)
+results['names'] = calibration.parameter_names(dimension)
+print ('%d forward runs for %d steps, %d proposals rejected by the surrogate'
+       % (results['num_evaluations'], nsimu, results['rejected_surrogate']))
+print ('%d forward runs stopped early' % results['num_truncated'])
+if low_fidelity is not None:
+    print ('%d runs at fidelity %d, %d at full fidelity'
+           % (sos.num_low, low_fidelity, sos.num_full))
+
+# dump run times
+with open ('runtimes.txt', 'w') as f:
+    f.write(str(model.runtimes))
+
+burnin = int(results['nsimu']/2)
+chain = results['chain'][burnin:, :]
+calibration.save_chain_outputs(chain, results['names'], results)
+
+with open('results.dill', 'wb') as f:
+    dill.dump(results, f)
+
+model.close()
+print ('done')
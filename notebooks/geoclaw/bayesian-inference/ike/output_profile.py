@@ -0,0 +1,134 @@
+r"""
+Gauge-only output profile for calibration runs, and a fast gauge reader.
+
+A calibration run only needs the time series of one field at one gauge, but
+setrun.py asks for full frames of q and aux four times per simulated day and
+for every column of every gauge.  gauge_only() turns all of that off except
+the requested gauges and fields, in binary if this version of GeoClaw
+supports it.
+
+read_gauge() returns the time series of a gauge as numpy arrays, reading the
+binary gauge file directly (or the text file with numpy if the gauge was
+written in ascii), without building a GaugeSolution.  A GaugeTail returns
+the records appended to a gauge file since it was last read, while the run
+is still writing it.  copy_gauge() copies the first records of a gauge, for
+restarting a run from a checkpoint.
+"""
+
+import os
+import re
+
+import numpy as np
+
+
+def gauge_only(rundata, gauge_ids, q_out_fields=None, binary=True):
+    r"""
+    Modify rundata in place so that the run writes no frames, no aux and no
+    fgmax output, and only the gauges in gauge_ids, with only q_out_fields
+    (0-based indices of h, hu, hv; default all) in binary (if binary is True
+    and supported).  GeoClaw always appends eta after the selected fields,
+    so it is the last row of the q returned by read_gauge.
+    """
+    clawdata = rundata.clawdata
+    clawdata.output_style = 1
+    clawdata.num_output_times = 0
+    clawdata.output_t0 = False
+    clawdata.output_q_components = 'none'
+    clawdata.output_aux_components = 'none'
+    clawdata.output_aux_onlyonce = True
+
+    gaugedata = rundata.gaugedata
+    gaugedata.gauges = [gauge for gauge in gaugedata.gauges
+                        if gauge[0] in gauge_ids]
+    if q_out_fields is not None:
+        gaugedata.q_out_fields = q_out_fields
+    if hasattr(gaugedata, 'aux_out_fields'):
+        gaugedata.aux_out_fields = 'none'
+    if binary and hasattr(gaugedata, 'file_format'):
+        gaugedata.file_format = 'binary'
+
+    fgmax_data = getattr(rundata, 'fgmax_data', None)
+    if fgmax_data is not None:
+        for name in ['fgmax_files', 'fgmax_grids']:
+            if hasattr(fgmax_data, name):
+                setattr(fgmax_data, name, [])
+    return rundata
+
+
+def _read_header(fname):
+    header = []
+    with open(fname) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            header.append(line)
+    return ''.join(header)
+
+
+def _gauge_paths(output, gauge_id):
+    name = 'gauge%s' % str(gauge_id).zfill(5)
+    return (os.path.join(output, name + '.txt'),
+            os.path.join(output, name + '.bin'))
+
+
+def _binary_layout(header):
+    r"""(num_columns, dtype) of binary gauge records, or None if not known"""
+    m = re.search(r'num_(?:eqn|var)\s*=\s*(\d+)', header)
+    if m is None:
+        return None
+    return 2 + int(m.group(1)), \
+        (np.float32 if 'binary32' in header else np.float64)
+
+
+def read_gauge(output, gauge_id):
+    r"""
+    Return (t, q) for gauge gauge_id in the directory output, with q a 2D
+    array with one row per output field (as GaugeSolution.q).
+    """
+    txt_path, bin_path = _gauge_paths(output, gauge_id)
+    header = _read_header(txt_path)
+
+    if os.path.exists(bin_path):
+        num_columns, dtype = _binary_layout(header)
+        data = np.fromfile(bin_path, dtype=dtype)
+        data = data[:len(data) // num_columns * num_columns]
+        data = data.reshape((-1, num_columns))
+    else:
+        data = np.loadtxt(txt_path, comments='#', ndmin=2)
+
+    # columns are level, t, q...
+    return data[:, 1], data[:, 2:].T
+
+
+def copy_gauge(output, dest, gauge_id, num_records, keep=None):
+    r"""
+    Copy the gauge files of gauge_id from the directory output to dest, with
+    only their first num_records records, e.g. to restart a run from a
+    checkpoint written after those records (GeoClaw appends to the gauge
+    files when restarting).  If keep is given, only the records where the
+    boolean array keep is True are counted and copied.
+    """
+    txt_path, bin_path = _gauge_paths(output, gauge_id)
+    dest_txt, dest_bin = _gauge_paths(dest, gauge_id)
+    header = _read_header(txt_path)
+    with open(dest_txt, 'w') as f:
+        f.write(header)
+        if not os.path.exists(bin_path):
+            with open(txt_path) as src:
+                records = (line for line in src
+                           if line.strip() and not line.startswith('#'))
+                if keep is not None:
+                    records = (line for line, k in zip(records, keep) if k)
+                for n, line in zip(range(num_records), records):
+                    f.write(line)
+    if os.path.exists(bin_path):
+        num_columns, dtype = _binary_layout(header)
+        record_size = num_columns * np.dtype(dtype).itemsize
+        if keep is None:
+            with open(bin_path, 'rb') as src, open(dest_bin, 'wb') as f:
+                f.write(src.read(num_records * record_size))
+        else:
+            data = np.fromfile(bin_path, dtype=dtype)
+            data = data[:len(data) // num_columns * num_columns]
+            data = data.reshape((-1, num_columns))[:len(keep)]
+            data[keep[:len(data)]][:num_records].tofile(dest_bin)
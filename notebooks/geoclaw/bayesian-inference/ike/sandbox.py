@@ -0,0 +1,106 @@
+r"""
+Private run directories for concurrent GeoClaw forward runs.
+
+Each Sandbox holds everything one evaluation writes: the data files, the
+storm file and the gauge output.  A SandboxPool keeps a fixed number of
+sandboxes under one root directory and hands them out one at a time, so
+that as many evaluations as there are sandboxes can run at once, and
+removes them all when it is closed.
+
+The executable is run directly in the sandbox output directory (as
+runclaw.py does) rather than through batch, whose BatchController changes
+the working directory of the whole process.
+"""
+
+import os
+import queue
+import shutil
+import tempfile
+import subprocess
+import contextlib
+
+
+class Sandbox(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.output = os.path.join(path, '_output')
+        self.storm_file = os.path.join(path, 'ike.storm')
+
+    def clean(self):
+        r"""Remove everything left in the sandbox by a previous run"""
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.makedirs(self.output)
+
+    def run(self, rundata, executable, env=None, monitor=None,
+            poll_interval=1.):
+        r"""
+        Write the data files in rundata to the output directory and run
+        executable there, with stdout and stderr going to run_output.txt and
+        run_errors.txt in the sandbox.
+
+        If monitor is given it is called every poll_interval seconds while
+        the executable runs, and the executable is killed if it returns
+        True.  Returns True if the executable was killed.
+        """
+        rundata.write(out_dir=self.output)
+        with open(os.path.join(self.path, 'run_output.txt'), 'w') as fout, \
+             open(os.path.join(self.path, 'run_errors.txt'), 'w') as ferr:
+            job = subprocess.Popen([executable], cwd=self.output, env=env,
+                                   stdout=fout, stderr=ferr)
+            while True:
+                try:
+                    return_code = job.wait(timeout=None if monitor is None
+                                           else poll_interval)
+                    break
+                except subprocess.TimeoutExpired:
+                    if monitor():
+                        job.kill()
+                        job.wait()
+                        return True
+        if return_code != 0:
+            raise RuntimeError("%s failed with return code %s, see %s"
+                               % (executable, return_code, self.path))
+        return False
+
+
+class SandboxPool(object):
+
+    def __init__(self, size=1, root=None, keep=False):
+        r"""
+        Create size sandboxes in a new temporary directory under root
+        (default: the system temporary directory).  With keep=True the
+        sandboxes are left on disk by close(), e.g. for debugging.
+        """
+        self.size = size
+        self.keep = keep
+        if root is not None and not os.path.exists(root):
+            os.makedirs(root)
+        self.root = tempfile.mkdtemp(prefix='ike_sandboxes_', dir=root)
+        self._free = queue.Queue()
+        for i in range(size):
+            self._free.put(Sandbox(os.path.join(self.root, '%03d' % i)))
+
+    @contextlib.contextmanager
+    def sandbox(self):
+        r"""
+        Context manager giving a clean sandbox, waiting for one to be free
+        if all are in use, and returning it to the pool afterwards.
+        """
+        sandbox = self._free.get()
+        try:
+            sandbox.clean()
+            yield sandbox
+        finally:
+            self._free.put(sandbox)
+
+    def close(self):
+        if not self.keep and os.path.exists(self.root):
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
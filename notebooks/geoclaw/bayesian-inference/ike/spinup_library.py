@@ -0,0 +1,231 @@
+r"""
+Library of checkpoints of previous forward runs, to restart perturbed storm
+runs from.
+
+The calibration parameters are the values of max_wind_speed at the times of
+the storm track, and GeoClaw interpolates the storm between those times.  Two
+runs whose parameter vectors first differ at track index k are therefore
+identical up to the last track time before k.  Each run checkpoints at the
+track times (see checkpoint_times()), and its checkpoints and gauge files are
+kept in the library, under a key of everything else the run depends on.  A
+new run is restarted from the latest checkpoint, of any run in the library,
+taken before the time its parameter vector diverges from that run's, so only
+the remaining time is simulated.
+
+When GeoClaw restarts it appends to the gauge files, so the gauge files of
+the library run are copied into the new run first, cut at the checkpoint.
+GeoClaw writes the records at the checkpoint time again after restarting;
+not_repeated() masks them out, both from the result of a restarted run and
+from its gauge files when they are added to the library.
+
+Files are hard linked rather than copied where possible, so the run
+directories should be on the same filesystem as the library (otherwise every
+checkpoint of every run is copied).  Entries are added atomically, and the
+least recently used entries are removed whenever the total size exceeds
+max_bytes.
+"""
+
+import os
+import glob
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+
+from output_profile import read_gauge, copy_gauge
+
+entry_name = 'entry.json'
+
+
+def read_tck(fname):
+    r"""Time of the checkpoint whose time stamp file is fname"""
+    with open(fname) as f:
+        line = f.readline()
+    return float(line.split('=')[-1]) if '=' in line else float(line[29:])
+
+
+def not_repeated(t, restart, first=0):
+    r"""
+    Mask of the gauge records t (numbered from first) of a run restarted
+    from the checkpoint restart (found by SpinupLibrary.find(), or None)
+    that are not written again at the checkpoint time
+    """
+    keep = np.ones(len(t), dtype=bool)
+    if restart is not None:
+        restarted = np.arange(first, first + len(t)) >= restart['num_records']
+        keep[restarted] = t[restarted] > restart['t']
+    return keep
+
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name))
+               for name in os.listdir(path))
+
+
+class SpinupLibrary(object):
+
+    def __init__(self, template, path='_spinup', max_bytes=20 * 2**30,
+                 every=1):
+        r"""
+        template is the StormTemplate of the runs, giving the track times and
+        unperturbed values.  Runs checkpoint at every every-th track time.
+        """
+        self.template = template
+        self.path = path
+        self.max_bytes = max_bytes
+        self.every = every
+        self.hits = 0
+        self.misses = 0
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def key(self, fingerprint, **kwargs):
+        r"""
+        Key of the runs that can share checkpoints: those with the same
+        fingerprint (see evaluation_cache.py) and keyword arguments, e.g.
+        the start time, gauge and fidelity.
+        """
+        h = hashlib.sha256(fingerprint.encode())
+        h.update(json.dumps(kwargs, sort_keys=True).encode())
+        return h.hexdigest()
+
+    def _values(self, parameter_value):
+        if parameter_value is None:
+            return self.template.base_values
+        return np.asarray(parameter_value, dtype=float)
+
+    def checkpoint_times(self, start, end):
+        r"""Track times in (start, end) to checkpoint at"""
+        return [float(t) for t in self.template.times[::self.every]
+                if start < t < end]
+
+    def divergence_time(self, a, b):
+        r"""
+        Time up to which runs with parameter vectors a and b are identical:
+        the last track time before the first index where they differ
+        """
+        differ = np.nonzero(np.asarray(a) != np.asarray(b))[0]
+        if len(differ) == 0:
+            return np.inf
+        times = self.template.times[self.template.rows < differ[0]]
+        return times.max() if len(times) > 0 else -np.inf
+
+    def _entries(self, key):
+        base = os.path.join(self.path, key)
+        if not os.path.exists(base):
+            return []
+        return [os.path.join(base, name) for name in os.listdir(base)
+                if not name.startswith('.')]
+
+    def find(self, parameter_value, key, t0):
+        r"""
+        Return the latest checkpoint after t0 that a run of parameter_value
+        can restart from, as a dictionary with its entry directory, chk and
+        tck file names, time t and the number of gauge records up to it, or
+        None if there is none.
+        """
+        values = self._values(parameter_value)
+        best = None
+        for entry_dir in self._entries(key):
+            try:
+                with open(os.path.join(entry_dir, entry_name)) as f:
+                    entry = json.load(f)
+            except (IOError, OSError, ValueError):
+                continue    # removed meanwhile
+            limit = self.divergence_time(values, entry['values'])
+            for checkpoint in entry['checkpoints']:
+                if t0 < checkpoint['t'] <= limit and \
+                   (best is None or checkpoint['t'] > best['t']):
+                    best = dict(checkpoint, entry_dir=entry_dir)
+        if best is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            try:
+                os.utime(best['entry_dir'])
+            except OSError:
+                pass
+        return best
+
+    def restore(self, checkpoint, output, gauge_id):
+        r"""
+        Put the checkpoint found by find() and the gauge files up to it in
+        the directory output, and return the name of the restart file.
+        """
+        for name in [checkpoint['chk'], checkpoint['tck']]:
+            _link_or_copy(os.path.join(checkpoint['entry_dir'], name),
+                          os.path.join(output, name))
+        copy_gauge(checkpoint['entry_dir'], output, gauge_id,
+                   checkpoint['num_records'])
+        return checkpoint['chk']
+
+    def add(self, parameter_value, key, output, gauge_id, restart=None):
+        r"""
+        Add the complete checkpoints of the run of parameter_value in the
+        directory output, with its gauge files.  If the run was restarted
+        from the checkpoint restart, only its later checkpoints are added,
+        and the gauge records repeated at the restart time are left out.
+        """
+        try:
+            t, q = read_gauge(output, gauge_id)
+        except (IOError, OSError):
+            return      # stopped before writing the gauge
+        keep = not_repeated(t, restart)
+        t = t[keep]
+        after = -np.inf if restart is None else restart['t']
+        checkpoints = []
+        for tck_path in sorted(glob.glob(os.path.join(output, 'fort.tck*'))):
+            chk_path = tck_path.replace('fort.tck', 'fort.chk')
+            # AMRClaw writes the .tck file once the checkpoint is complete
+            if not os.path.exists(chk_path) or \
+               os.path.getmtime(tck_path) < os.path.getmtime(chk_path):
+                continue
+            t_chk = read_tck(tck_path)
+            if t_chk > after:
+                checkpoints.append({'chk': os.path.basename(chk_path),
+                                    'tck': os.path.basename(tck_path),
+                                    't': t_chk,
+                                    'num_records': int((t <= t_chk).sum())})
+        if len(checkpoints) == 0:
+            return
+
+        base = os.path.join(self.path, key)
+        if not os.path.exists(base):
+            os.makedirs(base, exist_ok=True)
+        tmp = tempfile.mkdtemp(prefix='.tmp', dir=base)
+        for checkpoint in checkpoints:
+            for name in [checkpoint['chk'], checkpoint['tck']]:
+                _link_or_copy(os.path.join(output, name),
+                              os.path.join(tmp, name))
+        copy_gauge(output, tmp, gauge_id, len(t), keep=keep)
+        with open(os.path.join(tmp, entry_name), 'w') as f:
+            json.dump({'values': self._values(parameter_value).tolist(),
+                       'checkpoints': checkpoints}, f)
+        os.rename(tmp, os.path.join(base, os.path.basename(tmp)[len('.tmp'):]))
+        self.evict()
+
+    def evict(self):
+        r"""Remove least recently used entries until within max_bytes"""
+        entries = []
+        for key in os.listdir(self.path):
+            for entry_dir in self._entries(key):
+                try:
+                    entries.append((os.path.getmtime(entry_dir),
+                                    _dir_size(entry_dir), entry_dir))
+                except OSError:
+                    continue
+        total = sum(size for mtime, size, entry_dir in entries)
+        for mtime, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
@@ -0,0 +1,118 @@
+r"""
+Fast writer of GeoClaw storm files for perturbed storms.
+
+Parsing the ATCF track and writing the whole storm file on every forward run
+costs far more than the run needs: only one parameter (e.g. max_wind_speed)
+changes between evaluations.  A StormTemplate renders every line of the
+GeoClaw storm file of the unperturbed storm once, split around the column of
+the perturbed parameter, so that writing the file for new parameter values
+only formats those values and joins the pre-rendered pieces.
+
+The lines written are the same as those of Storm.write(..., file_format=
+'geoclaw') with the default fill functions: duplicate times are dropped, as
+are forecasts with any field equal to -1 (including the new value of the
+perturbed parameter).
+"""
+
+import os
+import gzip
+import shutil
+
+import numpy as np
+
+# columns of a GeoClaw storm file after the time and the eye location:
+columns = ['max_wind_speed', 'max_wind_radius', 'central_pressure',
+           'storm_radius']
+
+value_format = '19,.8e'
+
+
+def prepare_atcf(atcf_path):
+    r"""
+    Unzip atcf_path + '.gz' to atcf_path unless that is already up to date.
+    """
+    gz_path = atcf_path + '.gz'
+    if os.path.exists(atcf_path) and \
+       os.path.getmtime(atcf_path) >= os.path.getmtime(gz_path):
+        return atcf_path
+    # Note that the get_remote_file function does not support gzip files which
+    # are not also tar files.  The following code handles this
+    tmp_path = '%s.tmp%s' % (atcf_path, os.getpid())
+    with gzip.open(gz_path, 'rb') as atcf_file:
+        with open(tmp_path, 'wb') as atcf_unzipped_file:
+            shutil.copyfileobj(atcf_file, atcf_unzipped_file)
+    os.replace(tmp_path, atcf_path)
+    return atcf_path
+
+
+class StormTemplate(object):
+
+    def __init__(self, storm, parameter_name='max_wind_speed'):
+        r"""
+        Render the storm file lines of storm, leaving out parameter_name.
+        The storm is not modified and not needed afterwards.
+        """
+        self.parameter_name = parameter_name
+        self.base_values = np.array(getattr(storm, parameter_name),
+                                    dtype=float)
+        self.base_values.setflags(write=False)
+        column = columns.index(parameter_name)
+
+        time_offset = storm.time_offset
+        if time_offset is None:
+            # Use the first time in sequence if not provided
+            time_offset = storm.t[0]
+        self.header = "%s\n\n" % time_offset.isoformat()
+
+        rows = []
+        times = []
+        prefixes = []
+        suffixes = []
+        for n in range(len(storm.t)):
+            # Remove duplicate times
+            if n > 0 and storm.t[n] == storm.t[n - 1]:
+                continue
+            if isinstance(time_offset, float):
+                t = storm.t[n] - time_offset
+            else:
+                t = (storm.t[n] - time_offset).total_seconds()
+            fields = [getattr(storm, name)[n] for name in columns]
+            if any(value == -1 for i, value in enumerate(fields)
+                   if i != column):
+                continue
+            data = [t, storm.eye_location[n, 0], storm.eye_location[n, 1]] \
+                   + fields
+            strings = [format(value, value_format) for value in data]
+            rows.append(n)
+            times.append(t)
+            prefixes.append(' '.join(strings[:column + 3]) + ' ')
+            suffix = ' '.join(strings[column + 4:])
+            suffixes.append((' ' + suffix if suffix else '') + '\n')
+
+        # storm index and time in seconds of every line written
+        self.rows = np.array(rows, dtype=int)
+        self.times = np.array(times, dtype=float)
+        self.prefixes = prefixes
+        self.suffixes = suffixes
+
+    def render(self, values=None):
+        r"""
+        Return the contents of the storm file with parameter_name set to
+        values (the unperturbed values if None).
+        """
+        if values is None:
+            values = self.base_values
+        values = np.asarray(values, dtype=float)
+        assert len(values) == len(self.base_values), \
+            '%d != %d' % (len(values), len(self.base_values))
+
+        lines = [prefix + format(value, value_format) + suffix
+                 for prefix, value, suffix
+                 in zip(self.prefixes, values[self.rows], self.suffixes)
+                 if value != -1]
+        return "%s\n" % len(lines) + self.header + ''.join(lines)
+
+    def write(self, path, values=None):
+        r"""Write the storm file for values to path"""
+        with open(path, 'w') as data_file:
+            data_file.write(self.render(values))
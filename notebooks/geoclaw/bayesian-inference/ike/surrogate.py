@@ -0,0 +1,271 @@
+r"""
+Surrogate-accelerated MCMC for expensive forward models.
+
+A Gaussian-process emulator of log(sum of squares) is trained on a
+space-filling (Latin hypercube) design of forward runs and used to screen
+Metropolis proposals with two-stage delayed acceptance (Christen and Fox,
+2005):
+
+ 1. a proposal is accepted or rejected on the surrogate misfit alone, which
+    costs nothing,
+ 2. only if it passes, the forward model is run and the proposal accepted
+    with the probability that corrects for the surrogate's error, so that
+    the chain still samples the exact posterior.
+
+Every forward run made in stage 2 is added to the training set and the
+emulator refitted every refit_interval runs, so the surrogate keeps
+improving where the chain spends its time.  Only the latest max_points runs
+are used, which bounds the cost of refitting.
+
+With early_abort, the uniform variate of stage 2 is drawn before the forward
+run and turned into the largest misfit that could still be accepted, which
+is passed to the forward model as a bound so that it can stop as soon as its
+partial misfit exceeds it.  Such a run is rejected without changing the
+outcome of the step, and is not added to the training set.
+
+The posterior is the one sampled by pymcmcstat in optimize_ike.py: uniform
+priors within bounds, a likelihood exp(-ss / (2 sigma2)), and (with
+update_sigma) sigma2 drawn from its inverse gamma conditional each step.
+"""
+
+import time
+
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve, solve_triangular
+
+
+def latin_hypercube(num_samples, bounds, rng=None):
+    r"""
+    Return a (num_samples, d) Latin hypercube sample of the box bounds,
+    given as a (d, 2) array of (lower, upper).
+    """
+    rng = np.random.default_rng(rng)
+    bounds = np.asarray(bounds, dtype=float)
+    d = bounds.shape[0]
+    u = (rng.random((num_samples, d))
+         + np.array([rng.permutation(num_samples) for j in range(d)]).T) \
+        / num_samples
+    return bounds[:, 0] + u * (bounds[:, 1] - bounds[:, 0])
+
+
+class GaussianProcess(object):
+
+    def __init__(self, bounds, length_scales=None, nuggets=(1e-6, 1e-4, 1e-2)):
+        r"""
+        Gaussian process with a squared exponential kernel on the box bounds
+        (rescaled to the unit cube).  The isotropic length scale and the
+        nugget are chosen from the given values by maximizing the marginal
+        likelihood.
+        """
+        bounds = np.asarray(bounds, dtype=float)
+        self.lower = bounds[:, 0]
+        self.width = bounds[:, 1] - bounds[:, 0]
+        d = bounds.shape[0]
+        if length_scales is None:
+            length_scales = np.sqrt(d) * np.logspace(-1.5, 0.5, 12)
+        self.length_scales = length_scales
+        self.nuggets = nuggets
+        self.X = None
+
+    def _scale(self, X):
+        return (np.atleast_2d(X) - self.lower) / self.width
+
+    @staticmethod
+    def _sqdist(A, B):
+        return np.maximum((A**2).sum(1)[:, None] + (B**2).sum(1)[None, :]
+                          - 2 * A @ B.T, 0.)
+
+    def fit(self, X, y):
+        X = self._scale(X)
+        y = np.asarray(y, dtype=float)
+        self.y_mean = y.mean()
+        self.y_std = y.std() if y.std() > 0 else 1.
+        z = (y - self.y_mean) / self.y_std
+        d2 = self._sqdist(X, X)
+
+        best = None
+        for ell in self.length_scales:
+            for nugget in self.nuggets:
+                K = np.exp(-0.5 * d2 / ell**2) + nugget * np.eye(len(z))
+                try:
+                    L = cho_factor(K, lower=True)
+                except np.linalg.LinAlgError:
+                    continue
+                alpha = cho_solve(L, z)
+                lml = -0.5 * z @ alpha - np.log(np.diag(L[0])).sum()
+                if best is None or lml > best[0]:
+                    best = (lml, ell, nugget, L, alpha)
+        if best is None:
+            raise np.linalg.LinAlgError("No kernel gives a positive definite matrix")
+        lml, self.length_scale, self.nugget, self.L, self.alpha = best
+        self.X = X
+        return self
+
+    def predict(self, X, return_std=False):
+        Xs = self._scale(X)
+        Ks = np.exp(-0.5 * self._sqdist(Xs, self.X) / self.length_scale**2)
+        mean = self.y_mean + self.y_std * (Ks @ self.alpha)
+        if not return_std:
+            return mean
+        v = solve_triangular(self.L[0], Ks.T, lower=True)
+        var = np.maximum(1. + self.nugget - (v**2).sum(0), 0.)
+        return mean, self.y_std * np.sqrt(var)
+
+
+class DelayedAcceptanceMCMC(object):
+
+    def __init__(self, sos_function, bounds, num_observations, sigma2=0.01**2,
+                 update_sigma=True, refit_interval=10, adapt_interval=100,
+                 max_points=500, early_abort=False, rng=None):
+        r"""
+        sos_function(theta) returns the sum of squares of the forward model
+        at theta; num_observations is the number of residuals summed (used
+        for the sigma2 update).  With early_abort, stage 2 calls
+        sos_function(theta, bound=bound) instead, which returns (ss,
+        truncated), truncated being True if the run was stopped once its
+        partial sum of squares exceeded bound.
+        """
+        self.sos_function = sos_function
+        self.bounds = np.asarray(bounds, dtype=float)
+        self.num_observations = num_observations
+        self.sigma2 = sigma2
+        self.S20 = sigma2
+        self.N0 = 1.
+        self.update_sigma = update_sigma
+        self.refit_interval = refit_interval
+        self.max_points = max_points
+        self.adapt_interval = adapt_interval
+        self.early_abort = early_abort
+        self.rng = np.random.default_rng(rng)
+        self.surrogate = GaussianProcess(self.bounds)
+        self.X = []
+        self.y = []
+        self._since_fit = 0
+        self.num_evaluations = 0
+        self.num_truncated = 0
+
+    def add_evaluation(self, theta, ss):
+        r"""Add a forward run to the training set, refitting if due"""
+        self.X.append(np.array(theta, dtype=float))
+        self.y.append(np.log(max(ss, 1e-300)))
+        self._since_fit += 1
+        if self.surrogate.X is None or self._since_fit >= self.refit_interval:
+            self.refit()
+
+    def refit(self):
+        self.surrogate.fit(np.array(self.X[-self.max_points:]),
+                           np.array(self.y[-self.max_points:]))
+        self._since_fit = 0
+
+    def initial_design(self, num_samples, evaluate_many=None):
+        r"""
+        Run the forward model on a Latin hypercube design of num_samples
+        points, through evaluate_many(thetas) -> list of ss if given (e.g.
+        to run them concurrently), and train the surrogate on them.
+        """
+        thetas = latin_hypercube(num_samples, self.bounds, self.rng)
+        if evaluate_many is None:
+            sss = [self.sos_function(theta) for theta in thetas]
+        else:
+            sss = evaluate_many(thetas)
+        for theta, ss in zip(thetas, sss):
+            self.X.append(np.array(theta, dtype=float))
+            self.y.append(np.log(max(float(ss), 1e-300)))
+        self.num_evaluations += num_samples
+        self.refit()
+
+    def surrogate_ss(self, theta):
+        return float(np.exp(self.surrogate.predict(theta)[0]))
+
+    def _in_bounds(self, theta):
+        return np.all(theta >= self.bounds[:, 0]) and \
+               np.all(theta <= self.bounds[:, 1])
+
+    def run(self, theta0, nsimu, qcov=None, verbose=True):
+        r"""
+        Sample nsimu steps starting from theta0 and return a results
+        dictionary with the chain, s2chain and sschain and counts of the
+        proposals rejected by the surrogate and of forward runs made.
+        """
+        theta = np.array(theta0, dtype=float)
+        d = len(theta)
+        if qcov is None:
+            qcov = np.diag((0.05 * (self.bounds[:, 1] - self.bounds[:, 0]))**2)
+        R = np.linalg.cholesky(qcov)
+
+        ss = float(self.sos_function(theta))
+        self.num_evaluations += 1
+        self.add_evaluation(theta, ss)
+        ss_tilde = self.surrogate_ss(theta)
+
+        chain = np.empty((nsimu, d))
+        s2chain = np.empty((nsimu, 1))
+        sschain = np.empty((nsimu, 1))
+        accepted = 0
+        rejected_surrogate = 0
+        rejected_outside = 0
+        start = time.time()
+
+        for i in range(nsimu):
+            proposal = theta + R @ self.rng.standard_normal(d)
+            if not self._in_bounds(proposal):
+                rejected_outside += 1
+            else:
+                ss_tilde_new = self.surrogate_ss(proposal)
+                # stage 1: surrogate only
+                log_alpha1 = -(ss_tilde_new - ss_tilde) / (2 * self.sigma2)
+                if np.log(self.rng.random()) >= min(0., log_alpha1):
+                    rejected_surrogate += 1
+                else:
+                    # stage 2: forward model, correcting for the surrogate
+                    log_u = np.log(self.rng.random())
+                    correction = min(0., -log_alpha1) - min(0., log_alpha1)
+                    if self.early_abort:
+                        # accepted iff ss_new < bound
+                        bound = ss + 2 * self.sigma2 * (correction - log_u)
+                        ss_new, truncated = self.sos_function(proposal, bound=bound)
+                        ss_new = float(ss_new)
+                    else:
+                        ss_new, truncated = float(self.sos_function(proposal)), False
+                    self.num_evaluations += 1
+                    if truncated:
+                        self.num_truncated += 1
+                    else:
+                        self.add_evaluation(proposal, ss_new)
+                        log_alpha2 = -(ss_new - ss) / (2 * self.sigma2) + correction
+                        if log_u < min(0., log_alpha2):
+                            theta, ss = proposal, ss_new
+                            accepted += 1
+                    ss_tilde = self.surrogate_ss(theta)
+
+            if self.update_sigma:
+                shape = 0.5 * (self.N0 + self.num_observations)
+                scale = 0.5 * (self.N0 * self.S20 + ss)
+                self.sigma2 = scale / self.rng.gamma(shape)
+
+            chain[i] = theta
+            s2chain[i] = self.sigma2
+            sschain[i] = ss
+
+            # adaptive Metropolis (Haario et al. 2001)
+            if self.adapt_interval and (i + 1) % self.adapt_interval == 0 \
+                    and i + 1 >= 2 * d:
+                cov = np.atleast_2d(np.cov(chain[:i + 1].T))
+                try:
+                    R = np.linalg.cholesky(2.38**2 / d * cov + 1e-10 * np.eye(d))
+                except np.linalg.LinAlgError:
+                    pass
+
+            if verbose and (i + 1) % 100 == 0:
+                print('%d steps, %d accepted, %d rejected by surrogate, '
+                      '%d forward runs, %.0f s' % (i + 1, accepted,
+                      rejected_surrogate, self.num_evaluations,
+                      time.time() - start))
+
+        return {'chain': chain, 's2chain': s2chain, 'sschain': sschain,
+                'nsimu': nsimu, 'accepted': accepted,
+                'rejected_surrogate': rejected_surrogate,
+                'rejected_outside': rejected_outside,
+                'num_evaluations': self.num_evaluations,
+                'num_truncated': self.num_truncated,
+                'theta': theta, 'qcov': R @ R.T}
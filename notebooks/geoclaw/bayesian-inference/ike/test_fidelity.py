@@ -0,0 +1,82 @@
+r"""
+Fidelity levels and the multi-fidelity misfit, with a stand-in for the
+GeoClaw model whose low fidelity gauge series is an exact linear function of
+the full fidelity one.
+"""
+
+import types
+
+import numpy as np
+
+from fidelity import apply_fidelity, MultiFidelityMisfit
+from surrogate import DelayedAcceptanceMCMC
+
+t = np.linspace(0., 10., 50)
+data = 0.7 * np.sin(t) + 0.3 * np.cos(2 * t)
+
+
+class FakeModel(object):
+
+    def __init__(self):
+        self.fidelities = []
+
+    def run(self, parameter_name, thetas, t0, tfinal, gauge_id, fidelity=0):
+        self.fidelities.append(fidelity)
+        q = thetas[0] * np.sin(t) + thetas[1] * np.cos(2 * t)
+        if fidelity > 0:
+            q = (q - 0.1) / 2.
+        return t, q
+
+
+def sos(t_model, q_model):
+    return float(((q_model - data)**2).sum())
+
+
+def test_apply_fidelity_clips_flagregions():
+    flagregions = [types.SimpleNamespace(minlevel=1, maxlevel=5),
+                   types.SimpleNamespace(minlevel=5, maxlevel=6),
+                   types.SimpleNamespace(minlevel=1, maxlevel=2)]
+    rundata = types.SimpleNamespace(
+        clawdata=types.SimpleNamespace(num_cells=[40, 30]),
+        amrdata=types.SimpleNamespace(amr_levels_max=6,
+                                      refinement_ratios_x=[2, 2, 2, 4, 4]),
+        regiondata=types.SimpleNamespace(regions=[[5, 6, 0., 1e10,
+                                                   0., 1., 0., 1.]]),
+        flagregiondata=types.SimpleNamespace(flagregions=flagregions))
+    apply_fidelity(rundata, 2)
+    assert rundata.clawdata.num_cells == [20, 15]
+    assert rundata.amrdata.amr_levels_max == 4
+    assert rundata.regiondata.regions[0][:2] == [4, 4]
+    assert [(r.minlevel, r.maxlevel) for r in flagregions] \
+            == [(1, 4), (4, 4), (1, 2)]
+
+
+def run_chain(sos_function):
+    sampler = DelayedAcceptanceMCMC(sos_function, [(-2., 2.), (-2., 2.)],
+                                    num_observations=len(t), sigma2=0.01,
+                                    update_sigma=False, early_abort=True,
+                                    rng=3)
+    sampler.initial_design(6)
+    return sampler.run([0., 0.], 200, verbose=False)
+
+
+def test_multifidelity_chain():
+    model = FakeModel()
+    misfit = MultiFidelityMisfit(model, sos, 'max_wind_speed', 0., 10., 1,
+                                 fidelity=1, tolerance=1e-8)
+
+    def exact(thetas, bound=None):
+        ss = sos(*FakeModel().run(None, thetas, 0., 10., 1))
+        return ss if bound is None else (ss, False)
+
+    results = run_chain(misfit)
+    # the correction is exact, so the chain is the one of full fidelity runs
+    np.testing.assert_allclose(results['chain'], run_chain(exact)['chain'])
+    assert results['accepted'] > 0
+    assert abs(misfit.correction.a - 0.1) < 1e-8
+    assert abs(misfit.correction.b - 2.) < 1e-8
+    assert misfit.num_low == len([f for f in model.fidelities if f == 1])
+    assert misfit.num_full == len([f for f in model.fidelities if f == 0])
+    # only the runs fitting the correction and those of proposals that could
+    # be accepted are made at full fidelity
+    assert misfit.num_full < misfit.num_low
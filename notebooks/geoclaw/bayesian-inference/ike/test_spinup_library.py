@@ -0,0 +1,73 @@
+r"""
+Chained restarts from the spin-up library, with a stand-in for GeoClaw that
+writes binary gauge records every 5 s and checkpoints at the track times, and
+writes the record at the restart time again when restarted (as GeoClaw does).
+"""
+
+import os
+import types
+
+import numpy as np
+
+from output_profile import read_gauge
+from spinup_library import SpinupLibrary, not_repeated
+
+track_times = np.array([0., 10., 20., 30., 40.])
+
+
+def fake_run(output, restart_file=None):
+    t_start = 0.
+    if restart_file is not None:
+        tck = os.path.join(output, restart_file.replace('fort.chk', 'fort.tck'))
+        with open(tck) as f:
+            t_start = float(f.readline().split('=')[-1])
+    else:
+        with open(os.path.join(output, 'gauge00001.txt'), 'w') as f:
+            f.write('# gauge_id= 1\n# num_eqn= 1\n# file_format=binary\n')
+    times = np.arange(t_start, 40. + 1, 5.)
+    records = np.column_stack([np.ones(len(times)), times, times / 10.])
+    with open(os.path.join(output, 'gauge00001.bin'), 'ab') as f:
+        records.tofile(f)
+    for step, t in enumerate(track_times):
+        if t_start < t < 40.:
+            name = '%05d' % (step + 100 * (restart_file is not None))
+            with open(os.path.join(output, 'fort.chk' + name), 'w') as f:
+                f.write('checkpoint')
+            with open(os.path.join(output, 'fort.tck' + name), 'w') as f:
+                f.write(' Checkpoint file at time t =    %.10E\n' % t)
+
+
+def run(library, values, output):
+    os.makedirs(output)
+    key = library.key('fingerprint')
+    restart = library.find(values, key, 0.)
+    restart_file = None
+    if restart is not None:
+        restart_file = library.restore(restart, output, 1)
+    fake_run(output, restart_file)
+    library.add(values, key, output, 1, restart)
+    t, q = read_gauge(output, 1)
+    return t[not_repeated(t, restart)], restart
+
+
+def test_chained_restarts(tmp_path):
+    template = types.SimpleNamespace(times=track_times,
+                                     rows=np.arange(len(track_times)),
+                                     base_values=np.ones(len(track_times)))
+    library = SpinupLibrary(template, str(tmp_path / 'library'))
+    fresh = np.arange(0., 41., 5.)
+
+    t, restart = run(library, [1., 1., 1., 1., 1.], str(tmp_path / 'run1'))
+    assert restart is None
+    np.testing.assert_array_equal(t, fresh)
+
+    # differs from run 1 from track index 3 on: restarts at t = 20
+    t, restart = run(library, [1., 1., 1., 2., 2.], str(tmp_path / 'run2'))
+    assert restart['t'] == 20.
+    np.testing.assert_array_equal(t, fresh)
+
+    # same as run 2 up to index 3: restarts at t = 30 from run 2's entry,
+    # whose gauge files must not hold the record repeated at t = 20
+    t, restart = run(library, [1., 1., 1., 2., 3.], str(tmp_path / 'run3'))
+    assert restart['t'] == 30.
+    np.testing.assert_array_equal(t, fresh)
@@ -0,0 +1,105 @@
+r"""
+Append-only binary store of forward model evaluations.
+
+Every evaluation appends its parameter vector, misfit, wall time and gauge
+series (t, q) to a store directory holding two files:
+
+ - data.bin, the float64 values of each record one after the other: the
+   parameter vector, then t, then q,
+ - index.bin, one fixed size entry per record (see index_dtype) giving where
+   its values start in data.bin and how many there are, with the scalars.
+
+Appends are serialized with an exclusive lock on the store (fcntl.flock, so
+several processes and threads can write to the same store), and an index
+entry is only written after its data, so readers never see a partial record.
+Reading memory-maps both files, so any record can be read without reading
+the others, e.g. to train a surrogate on all of the runs made so far.
+"""
+
+import os
+import time
+import fcntl
+import threading
+
+import numpy as np
+
+index_dtype = np.dtype([('offset', '<i8'), ('dimension', '<i4'),
+                        ('length', '<i4'), ('misfit', '<f8'),
+                        ('wall_time', '<f8'), ('timestamp', '<f8')])
+
+
+class TraceStore(object):
+
+    def __init__(self, path='_traces'):
+        self.path = path
+        self.data_path = os.path.join(path, 'data.bin')
+        self.index_path = os.path.join(path, 'index.bin')
+        self.lock_path = os.path.join(path, 'lock')
+        self._lock = threading.Lock()
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+        for fname in [self.data_path, self.index_path]:
+            open(fname, 'ab').close()
+
+    def append(self, theta, misfit, wall_time, t, q):
+        r"""Record one evaluation and return its record number"""
+        theta = np.ravel(np.asarray(theta, dtype='<f8'))
+        t = np.ravel(np.asarray(t, dtype='<f8'))
+        q = np.ravel(np.asarray(q, dtype='<f8'))
+        assert len(t) == len(q), '%d != %d' % (len(t), len(q))
+        entry = np.zeros(1, dtype=index_dtype)
+        entry['dimension'] = len(theta)
+        entry['length'] = len(t)
+        entry['misfit'] = misfit
+        entry['wall_time'] = wall_time
+        entry['timestamp'] = time.time()
+
+        with self._lock, open(self.lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.data_path, 'ab') as f:
+                    entry['offset'] = f.seek(0, os.SEEK_END) // 8
+                    f.write(theta.tobytes() + t.tobytes() + q.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                with open(self.index_path, 'ab') as f:
+                    number = f.seek(0, os.SEEK_END) // index_dtype.itemsize
+                    f.write(entry.tobytes())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return number
+
+    def index(self):
+        r"""The index entries of all complete records (a memory map)"""
+        num_records = os.path.getsize(self.index_path) // index_dtype.itemsize
+        if num_records == 0:
+            return np.zeros(0, dtype=index_dtype)
+        return np.memmap(self.index_path, dtype=index_dtype, mode='r',
+                         shape=(num_records,))
+
+    def __len__(self):
+        return os.path.getsize(self.index_path) // index_dtype.itemsize
+
+    def __getitem__(self, number):
+        r"""
+        Record number as a dictionary with theta, misfit, wall_time,
+        timestamp, t and q (views of the memory-mapped data)
+        """
+        entry = self.index()[number]
+        size = int(entry['dimension']) + 2 * int(entry['length'])
+        values = np.memmap(self.data_path, dtype='<f8', mode='r',
+                           offset=8 * int(entry['offset']), shape=(size,))
+        d, n = int(entry['dimension']), int(entry['length'])
+        return {'theta': values[:d], 't': values[d:d + n],
+                'q': values[d + n:], 'misfit': float(entry['misfit']),
+                'wall_time': float(entry['wall_time']),
+                'timestamp': float(entry['timestamp'])}
+
+    def parameters(self):
+        r"""(thetas, misfits) of all records, as arrays"""
+        index = self.index()
+        data = np.memmap(self.data_path, dtype='<f8', mode='r') \
+            if len(index) > 0 else np.zeros(0)
+        thetas = np.array([data[offset:offset + dimension] for offset, dimension
+                           in zip(index['offset'], index['dimension'])])
+        return thetas, np.array(index['misfit'])